@@ -0,0 +1,29 @@
+"""
+Benchmark of the ripple carry adder (CPA) against the parallel prefix adders.
+
+Reports, for each word size, the time to elaborate each adder and, over a
+sequence of random additions, the events (wire changes) and circuit evaluations
+per addition and the time per addition.
+
+    python benchmarks/adders.py [sizes...]
+"""
+import os, sys, random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pdd.tools import benchmark
+from pdd.combinational_blocks import CPA, KoggeStone, BrentKung, CarryLookahead
+
+ADDERS = [CPA, KoggeStone, BrentKung, CarryLookahead]
+ADDITIONS = 200
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [8, 16, 32, 64]
+    rng = random.Random(0)
+    print('{:>5} {:<15} {:>9} {:>10} {:>10} {:>10}'.format('bits', 'adder', 'build', 'events/op',
+                                                            'evals/op', 'us/op'))
+    for size in sizes:
+        vectors = [dict(a=rng.getrandbits(size), b=rng.getrandbits(size), cin=rng.getrandbits(1))
+                   for _ in range(ADDITIONS)]
+        for cls in ADDERS:
+            m = benchmark(lambda: cls(size=size), vectors)
+            print('{:>5} {:<15} {:>9.3f} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                size, cls.__name__, m.build, m.events, m.evaluations, m.us))
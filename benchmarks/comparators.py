@@ -0,0 +1,30 @@
+"""
+Benchmark of Comparator against SharedComparator.
+
+Reports, for each word size, the time to elaborate each comparator, its gate
+count (gate bits) and, over a sequence of random inputs, the events (wire
+changes) and circuit evaluations per comparison and the time per comparison.
+
+    python benchmarks/comparators.py [sizes...]
+"""
+import os, sys, random
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pdd.tools import benchmark
+from pdd.combinational_blocks import Comparator, SharedComparator, KoggeStone
+
+COMPARISONS = 100
+
+COMPARATORS = [('Comparator', Comparator), ('SharedComparator', SharedComparator),
+               ('Shared+KoggeStone', lambda **kwargs: SharedComparator(adder=KoggeStone, **kwargs))]
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [8, 16, 32]
+    rng = random.Random(0)
+    print('{:>5} {:<18} {:>8} {:>7} {:>10} {:>9} {:>9}'.format('bits', 'comparator', 'build', 'gates',
+                                                              'events/op', 'evals/op', 'us/op'))
+    for size in sizes:
+        vectors = [dict(a=rng.getrandbits(size), b=rng.getrandbits(size)) for _ in range(COMPARISONS)]
+        for name, factory in COMPARATORS:
+            m = benchmark(lambda: factory(size=size), vectors)
+            print('{:>5} {:<18} {:>8.3f} {:>7} {:>10.1f} {:>9.1f} {:>9.1f}'.format(
+                size, name, m.build, m.gates, m.events, m.evaluations, m.us))
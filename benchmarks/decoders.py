@@ -0,0 +1,92 @@
+"""
+Elaboration benchmark for address decoders and memories.
+
+For each address width and each decoder (the recursive Decoder, PredecodedDecoder
+and the behavioral model of Decoder) reports the time to elaborate it, its gate
+count (gate bits), the events (wire changes) and circuit evaluations per address
+change and the time to read Decoder.y a hundred times. Then reports the time to
+elaborate a ROM and a RAM.
+
+As a baseline, the reads of Decoder.y and the ROM and RAM are timed again in the
+same run with the old path (see legacy): pairwise, quadratic Bus.merge and
+Decoder.y merged on every access.
+
+    python benchmarks/decoders.py [widths...]
+"""
+import os, sys, time, random
+from contextlib import contextmanager
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pdd.core import Simulation
+from pdd.tools import benchmark
+from pdd.dl import Bus
+from pdd.combinational_blocks import Decoder, PredecodedDecoder, ROM
+from pdd.sequential_blocks import RAM
+
+CHANGES = 100
+
+def legacy_merge(cls, buses):
+    """Bus.merge before it was made linear: buses are added one at a time"""
+    buses = list(buses)
+    bus = buses.pop()
+    while buses:
+        bus = bus + buses.pop()
+    return bus
+
+@contextmanager
+def legacy():
+    """Within the with block Bus.merge and Decoder.y take the old path"""
+    merge, y = Bus.__dict__['merge'], Decoder.__dict__['y']
+    Bus.merge = classmethod(legacy_merge)
+    Decoder.y = property(lambda self: Bus.merge(self.get_buses(self.output_labels)))
+    try:
+        yield
+    finally:
+        Bus.merge, Decoder.y = merge, y
+
+def reads(decoder):
+    """Return the seconds taken by 100 reads of decoder.y"""
+    start = time.perf_counter()
+    for _ in range(100):
+        decoder.y
+    return time.perf_counter() - start
+
+def timed(f):
+    """Return the seconds taken by f() in a Simulation of its own"""
+    with Simulation():
+        start = time.perf_counter()
+        f()
+        return time.perf_counter() - start
+
+def bench(factory, width):
+    """Return the Measure of the decoder made by factory over address changes and
+    the time of 100 reads of y, then with the old path"""
+    rng = random.Random(0)
+    vectors = [dict(a=rng.getrandbits(width)) for _ in range(CHANGES)]
+    measure = benchmark(lambda: factory(a=Bus(width), e=Bus.vdd()), vectors)
+    y = reads(measure.circuit)
+    with legacy():
+        y_legacy = reads(measure.circuit)
+    return measure, y, y_legacy
+
+DECODERS = [('Decoder', Decoder), ('PredecodedDecoder', PredecodedDecoder),
+            ('behavioral', lambda **kwargs: Decoder(model='behavioral', **kwargs))]
+
+if __name__ == '__main__':
+    widths = [int(arg) for arg in sys.argv[1:]] or [8, 10, 12]
+    print('{:>5} {:<18} {:>8} {:>8} {:>12} {:>11} {:>11} {:>11}'.format(
+        'addr', 'decoder', 'build', 'gates', 'events/addr', 'evals/addr', '100x dec.y', 'legacy'))
+    for width in widths:
+        for name, factory in DECODERS:
+            m, y, y_legacy = bench(factory, width)
+            print('{:>5} {:<18} {:>8.3f} {:>8} {:>12.1f} {:>11.1f} {:>11.3f} {:>11.3f}'.format(
+                width, name, m.build, m.gates, m.events, m.evaluations, y, y_legacy))
+    print()
+    print('{:>5} {:>10} {:>10} {:>10} {:>10}'.format('addr', 'rom', 'legacy', 'ram', 'legacy'))
+    for width in widths:
+        rom = timed(lambda: ROM(4, addr=Bus(width)))
+        ram = timed(lambda: RAM(4, addr=Bus(width)))
+        with legacy():
+            rom_legacy = timed(lambda: ROM(4, addr=Bus(width)))
+            ram_legacy = timed(lambda: RAM(4, addr=Bus(width)))
+        print('{:>5} {:>10.3f} {:>10.3f} {:>10.3f} {:>10.3f}'.format(width, rom, rom_legacy,
+                                                                  ram, ram_legacy))
@@ -0,0 +1,42 @@
+"""
+Benchmark of building designs within Simulation.elaborate against building them
+eagerly.
+
+For each design reports the time to build it eagerly, the time to build it
+within an elaborate block (including the settling when the block exits) and the
+speedup of the latter. Times are the best of a few runs.
+
+    python benchmarks/elaborate.py
+"""
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pdd.core import Simulation
+from pdd.dl import Bus
+from pdd.combinational_blocks import ROM, Decoder
+from pdd.sequential_blocks import RAM
+
+RUNS = 3
+DESIGNS = [('RAM(8, size=8)', lambda: RAM(8, size=8)),
+           ('RAM(6, size=4)', lambda: RAM(6, size=4)),
+           ('ROM(8, size=8)', lambda: ROM(8, addr=Bus(8))),
+           ('Decoder(size=8)', lambda: Decoder(size=8))]
+
+def build(factory, deferred):
+    """Return the least seconds taken to build factory() in a Simulation of its own"""
+    times = []
+    for _ in range(RUNS):
+        with Simulation() as sim:
+            start = time.perf_counter()
+            if deferred:
+                with sim.elaborate():
+                    factory()
+            else:
+                factory()
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+if __name__ == '__main__':
+    print('{:<16} {:>9} {:>9} {:>8}'.format('design', 'eager', 'elaborate', 'speedup'))
+    for name, factory in DESIGNS:
+        eager, deferred = build(factory, False), build(factory, True)
+        print('{:<16} {:>9.3f} {:>9.3f} {:>7.2f}x'.format(name, eager, deferred, eager / deferred))
@@ -0,0 +1,42 @@
+"""
+Benchmark of stamping circuits from a Prototype against building them.
+
+For each circuit reports the time to build 100 copies, the time to clone 100
+copies from a prototype and the ratio of the two (how many times faster cloning
+is). Times are the best of a few runs.
+
+    python benchmarks/prototypes.py [copies]
+"""
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pdd.core import Simulation
+from pdd.combinational_blocks import CPA, Decoder
+from pdd.sequential_blocks import FlipFlop
+
+RUNS = 5
+CIRCUITS = [('FlipFlop', FlipFlop, dict(size=8)), ('CPA', CPA, dict(size=8)),
+            ('Decoder', Decoder, dict(size=4))]
+
+def best(f):
+    """Return the least seconds taken by f() over RUNS runs"""
+    times = []
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def bench(cls, copies, **kwargs):
+    """Return the seconds taken to build and to clone copies of cls(**kwargs)"""
+    with Simulation():
+        prototype = cls.prototype(**kwargs)
+        build = best(lambda: [cls(**kwargs) for _ in range(copies)])
+        clone = best(lambda: [prototype.clone() for _ in range(copies)])
+    return build, clone
+
+if __name__ == '__main__':
+    copies = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    print('{:<10} {:>9} {:>9} {:>7}'.format('circuit', 'build', 'clone', 'ratio'))
+    for name, cls, kwargs in CIRCUITS:
+        build, clone = bench(cls, copies, **kwargs)
+        print('{:<10} {:>9.3f} {:>9.3f} {:>6.1f}x'.format(name, build, clone, build / clone))
@@ -0,0 +1,96 @@
+"""
+Signal allocation micro-benchmark.
+
+Assigns the inputs of gates of several widths and reports the time per
+assignment, how many Signals were requested and how many had to be allocated,
+ie. weren't interned. Without interning every request is an allocation.
+
+Then replays the Signal work of a gate update (reading both inputs, the logic
+operation, its complement, its bits and a comparison) with Signal and with
+LegacySignal, the Signal this module replaced, as a baseline in the same run.
+
+    python benchmarks/signal_alloc.py [updates]
+"""
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pdd.core import Signal
+from pdd.combinational_blocks import Gate
+
+class LegacySignal:
+    """Signal before interning, slots and cached masks, kept as a baseline"""
+    def __init__(self, value, size):
+        if type(value) is not int:
+            raise TypeError('Argument of type {} to {}. Must be an Integer'.format(type(value), self.__class__))
+        self.value = value
+        self._size = size
+
+    @property
+    def bits(self):
+        return tuple(self.value >> i & 0x1 for i in range(self._size))
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    @classmethod
+    def NOT(cls, a):
+        mask = 0
+        for i in range(a._size):
+            mask |= 1 << i
+        return cls(~a.value & mask, a._size)
+
+    @classmethod
+    def XOR(cls, a, b):
+        return cls(a.value ^ b.value, a._size)
+
+def replay(cls, size, updates):
+    """Return the seconds taken by the Signal work of updates gate updates with cls"""
+    values = [(i * 2654435761) & Signal.mask(size) for i in range(64)]
+    start = time.perf_counter()
+    for i in range(updates):
+        a = cls(values[i % 64], size)
+        b = cls(values[(i + 7) % 64], size)
+        y = cls.XOR(a, b)
+        cls.NOT(y).bits
+        y == a
+    return time.perf_counter() - start
+
+def count_signals():
+    """Wrap Signal.__new__, return the counters it fills"""
+    counters = dict(requested=0, allocated=0)
+    new = Signal.__new__
+    def counting_new(cls, value, size, unknown=0):
+        signal = new(cls, value, size, unknown)
+        counters['requested'] += 1
+        small = Signal._small[size] if size <= Signal.interned_size else ()
+        if not (0 <= value < len(small) and small[value] is signal):
+            counters['allocated'] += 1
+        return signal
+    Signal.__new__ = counting_new
+    return counters, new
+
+def run(size, updates):
+    gate = Gate(Gate.XOR, size=size)
+    values = [(i * 2654435761) & Signal.mask(size) for i in range(64)]
+    counters, new = count_signals()
+    start = time.perf_counter()
+    for i in range(updates):
+        gate.a = values[i % 64]
+        gate.b = values[(i + 7) % 64]
+    elapsed = time.perf_counter() - start
+    Signal.__new__ = new
+    return elapsed, counters
+
+if __name__ == '__main__':
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    print('{:>5} {:>12} {:>10} {:>10}'.format('bits', 'us/assign', 'signals', 'allocated'))
+    for size in (1, 4, 8, 32):
+        elapsed, counters = run(size, updates)
+        print('{:>5} {:>12.2f} {:>10} {:>10}'.format(size, elapsed / updates / 2 * 1e6,
+                                                     counters['requested'], counters['allocated']))
+    print()
+    print('{:>5} {:>14} {:>14} {:>8}'.format('bits', 'legacy us/upd', 'signal us/upd', 'speedup'))
+    for size in (1, 4, 8, 32):
+        legacy = min(replay(LegacySignal, size, updates) for _ in range(3))
+        new = min(replay(Signal, size, updates) for _ in range(3))
+        print('{:>5} {:>14.3f} {:>14.3f} {:>7.1f}x'.format(size, legacy / updates * 1e6,
+                                                         new / updates * 1e6, legacy / new))
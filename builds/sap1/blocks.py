@@ -3,7 +3,7 @@ from pdd.gates import *
 import pdd.sequential_blocks as sb
 from pdd.dl import Bus, BaseCircuit
 
-class ALU(BaseCircuit):
+class ALU(cb.AdderMixin, BaseCircuit):
     """
     Simple ALU with addition and subtraction. Tristated output, 
     tristate is low-active (ie e signal 1 laves s at high Z).
@@ -11,11 +11,12 @@ class ALU(BaseCircuit):
     input_labels = "a b sub e".split()
     output_labels = "s".split()
     sizes = dict(e=1, sub=1)
+
     def make(self):
         i = self.get_inputs()
         #Mux controls whether B should be negated or not
         select_b = cb.BaseMux(d0=i.b, d1=i.b, s=i.sub, bubbles=['d1'])
-        adder = cb.CPA(a=i.a, b=select_b.y, cin=i.sub)
+        adder = self.adder(a=i.a, b=select_b.y, cin=i.sub)
         not_e = INV(a=i.e).y
         self.set_tristate(s=not_e)
         self.set_outputs(s=adder.s)
@@ -36,7 +37,7 @@ class DoubleFlipFlop(BaseCircuit):
         mux = cb.BaseMux(d0=i.d, s=i.l)
         reg = sb.FlipFlop(d=mux.y, clk=i.clk, r=i.r)
         mux.connect(d1=reg.q)
-        inverter = OR(a=i.e, bubbles=['y'])
+        inverter = INV(a=i.e)
         self.set_tristate(qt=inverter.y)
         self.set_outputs(q=reg.q, qt=reg.q)
 
@@ -69,12 +70,13 @@ class StateArchitectureUnit(BaseCircuit):
     output_labels = "wout ic out iw".split()
     sizes = dict(win=8, wout=8, out=8, ic=3, iw=4)
     sizes.update({l:1 for l in input_flags.split() + 'r clk lwin'.split()})
+    defaults = dict(lwin=0)
 
     def make(self):
         i = self.get_inputs()
         self.set_outputs(wout=i.win)
         self.set_tristate(win=i.lwin)
-        W = i.win
+        W = i.win.resolve()
         clk = i.clk
         r = i.r
 
@@ -131,6 +133,7 @@ class Processor(BaseCircuit):
     input_labels = "clk r".split()
     output_labels = "out wout".split()
     sizes = dict(clk=1, r=1, lwin=1, out=8, win=8, wout=8)
+    defaults = dict(clk=0, r=0)
        
     def make(self):
         i = self.get_inputs()
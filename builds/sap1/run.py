@@ -1,22 +1,20 @@
-from pdd.dl import Bus
-from pdd.tools import TruthTable, BaseCircuitTester, Inspector
-from pdd.tools import SignalGen, Inspector
+from concurrent.futures import ProcessPoolExecutor
+from pdd.core import Simulation
 from blocks import *
 
-p1 = Processor()
-p1.load_rom('p1.txt')
-clk = p1.clk
-p2 = Processor(clk=clk)
-p2.load_rom('p2.txt')
-p3 = Processor(clk=clk)
-p3.load_rom('p3.txt')
-p1.reset()
-p2.reset()
-p3.reset()
-for i in range(6*4+1):
-    print("clock " + str(i))
-    clk.pulse()
+def run(program, cycles=6*4+1):
+    """Run program on a Processor of its own Simulation, return the final state"""
+    with Simulation() as sim:
+        with sim.elaborate():
+            p = Processor()
+        p.load_rom(program)
+        p.reset()
+        for i in range(cycles):
+            p.clk.pulse()
+        return repr(p)
 
-print("resultado prog. 1" + repr(p1))
-print("resultado prog. 2" + repr(p2))
-print("resultado prog. 3" + repr(p3))
+if __name__ == '__main__':
+    programs = ['p1.txt', 'p2.txt', 'p3.txt']
+    with ProcessPoolExecutor() as pool:
+        for i, result in enumerate(pool.map(run, programs)):
+            print("resultado prog. {}".format(i + 1) + result)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import unittest
 from pdd.dl import Bus
+from pdd.core import Simulation, Signal
 from pdd.tools import TruthTable, BaseCircuitTester, Inspector
 from blocks import *
 
@@ -40,6 +41,17 @@ class TestSapBlocks(BaseCircuitTester):
         self.assertSigEq(circ.q, 3)
         self.assertSigEq(circ.qt, 2)
 
+    def test_four_state_double_flip(self):
+        """qt is enabled through an INV, so it isn't X while e is known"""
+        with Simulation(four_state=True):
+            qt = Bus(4).resolve()
+            circ = DoubleFlipFlop(d=Bus(4, 5), e=Bus(1, 0), l=Bus(1, 0), clk=Bus(1, 0),
+                                  r=Bus(1, 0), qt=qt)
+            circ.clk.pulse()
+            self.assertEqual(circ.qt.signal, Signal(5, 4))
+            circ.e.set()
+            self.assertEqual(str(circ.qt.signal), '0bzzzz')
+
 
 
 class TestCU(BaseCircuitTester):
@@ -2,7 +2,7 @@
 Combinal Logic building blocks
 """
 from pdd.core import Signal
-from pdd.dl import BaseCircuit, Bus
+from pdd.dl import BaseCircuit, BehavioralCircuit, Bus
 import pdd.tools as tools
 
 
@@ -21,15 +21,18 @@ class Gate(BaseCircuit):
     def __init__(self, op, **kwargs):
         self.op = op
         super().__init__(**kwargs)
-        self.update()
+        if not self.sim.deferring:
+            self.update()
 
     def update(self):
-        self.terminals['a'].propagate()
-        self.terminals['b'].propagate()
-        i = self.get_inputs()
-        out = self.op(i.a.signal, i.b.signal)
-        self.terminals['y'].a.signal = out
-        self.terminals['y'].propagate() 
+        if self.gated and self._gate():
+            return
+        terminals = self.terminals
+        a, b, y = terminals['a'], terminals['b'], terminals['y']
+        a.propagate()
+        b.propagate()
+        y.a.signal = self.op(a.y.signal, b.y.signal)
+        y.propagate()
 
     def __repr__(self):
         i = ['{}={}; '.format(label, str(self.terminals[label].a.signal)) for label in self.input_labels]
@@ -39,7 +42,10 @@ class Gate(BaseCircuit):
 
 class nGate(BaseCircuit):
     """
-    n inputs logical gates
+    n inputs logical gates. Inputs are reduced by a balanced tree of 2 input gates,
+    a level of the tree being a single word-wide Gate, so the depth is log2(n).
+    The behavioral model of nGate is PrimitiveGate, a single n input gate, eg.
+    AND(inputs=8, model='behavioral')
     """
     def __init__(self, inputs, op, **kwargs):
         self.input_labels = ['a{}'.format(i) for i in range(inputs)]
@@ -50,11 +56,13 @@ class nGate(BaseCircuit):
 
     def make(self):
         i = self.get_inputs()
-        gates = [Gate(self.op, size=len(i.a0)) for _ in range(self.inputs - 1)]
-        gates[0].connect(a=i.a0, b=i.a1)
-        for j, gate in enumerate(gates[1:]):
-            gate.connect(a=gates[j].y, b=i[j+2])
-        self.set_outputs(y=gates[-1].y)
+        size = len(i.a0)
+        buses = list(i[:self.inputs])
+        while len(buses) > 1:
+            pairs = len(buses) // 2
+            gate = Gate(self.op, a=Bus.merge(buses[:2 * pairs:2]), b=Bus.merge(buses[1:2 * pairs:2]))
+            buses = [gate.y[k * size:(k + 1) * size] for k in range(pairs)] + buses[2 * pairs:]
+        self.set_outputs(y=buses[0])
         
     def __repr__(self):
         i = ['{}={}; '.format(label, str(self.terminals[label].a.signal)) for label in self.input_labels]
@@ -63,6 +71,26 @@ class nGate(BaseCircuit):
         return s.format(Gate.gate_type[self.op])
 
 
+class PrimitiveGate(BehavioralCircuit, nGate):
+    """
+    n input logic gate evaluated at once, the behavioral model of nGate.
+    Like Gate it's a leaf, four-state inputs are handled by the Signal operations
+    """
+    def update(self):
+        if self.gated and self._gate():
+            return
+        terminals = self.terminals
+        op = self.op
+        signal = None
+        for label in self.input_labels:
+            terminal = terminals[label]
+            terminal.propagate()
+            signal = terminal.y.signal if signal is None else op(signal, terminal.y.signal)
+        y = terminals['y']
+        y.a.signal = signal
+        y.propagate()
+
+
 def AND(inputs=2, **kwargs):
     """Factory for Logic AND gate"""
     if inputs == 2:
@@ -85,6 +113,10 @@ def OR(inputs=2, **kwargs):
         return nGate(inputs, op=Gate.OR, **kwargs)
 
 def INV(**kwargs):
+    """OR gate with a bubble at y. b is tied to GND, an unconnected b would be X
+    in four-state simulations"""
+    if 'b' not in kwargs:
+        kwargs['b'] = Bus.gnd(kwargs.get('a', kwargs.get('y', kwargs.get('size', 1))))
     return Gate(op=Gate.OR, bubbles=['y'], **kwargs)
 
 class BaseMux(BaseCircuit):
@@ -182,6 +214,7 @@ class CPA(BaseCircuit):
     input_labels = "a b cin".split()
     output_labels = "s cout".split()
     sizes = dict(cin=1, cout=1)
+    defaults = dict(cin=0)
 
     def make(self):
         i = self.get_inputs()
@@ -199,6 +232,151 @@ class CPA(BaseCircuit):
         s = Bus.merge([adder.s for adder in adders])
         self.set_outputs(s=s, cout=adders[-1].cout)
 
+class BehavioralCPA(BehavioralCircuit, CPA):
+    """
+    Behavioral model of CPA, a single evaluation instead of the ripple of full adders
+    """
+    def function(self, a, b, cin):
+        s = a.value + b.value + cin.value
+        return dict(s=s, cout=s >> self.sizes['a'])
+
+class PrefixAdder(BaseCircuit):
+    """
+    Parallel prefix adder, a drop-in replacement for CPA (same labels and sizes).
+    Carries are computed in log-depth by a prefix network over the bit generate
+    (a & b) and propagate (a ^ b) signals instead of rippling. cin is folded
+    into the generate of bit 0, so carry i + 1 is the group generate of bits i..0.
+
+    Subclasses define the network with levels(n), the list of levels for n bits.
+    A level is a list of cells (u, v): node u is combined with node v < u, whose
+    group must end right below the group of u. The cells of a level are made as
+    word-wide gates, one gate per operation and level.
+    """
+    input_labels = "a b cin".split()
+    output_labels = "s cout".split()
+    sizes = dict(cin=1, cout=1)
+    defaults = dict(cin=0)
+
+    def levels(self, n):
+        """levels must be implemented by subclasses. Return the prefix network
+        for n bits as a list of levels of cells"""
+        pass
+
+    def make(self):
+        i = self.get_inputs()
+        n = self.sizes['a']
+        generate = AND(a=i.a, b=i.b)
+        propagate = XOR(a=i.a, b=i.b)
+        g, p = generate.y.split(), propagate.y.split()
+        carry_in = AND(a=p[0], b=i.cin)
+        g[0] = OR(a=g[0], b=carry_in.y).y
+        low = list(range(n))
+        for level in self.levels(n) or []:
+            upper, lower = [u for u, _ in level], [v for _, v in level]
+            pg = AND(a=Bus.merge(p[u] for u in upper), b=Bus.merge(g[v] for v in lower))
+            gg = OR(a=Bus.merge(g[u] for u in upper), b=pg.y).y.split()
+            #groups reaching bit 0 are complete, their propagate isn't needed
+            black = [(u, v) for u, v in level if low[v]]
+            if black:
+                pp = AND(a=Bus.merge(p[u] for u, _ in black),
+                         b=Bus.merge(p[v] for _, v in black)).y.split()
+                for bit, (u, _) in zip(pp, black):
+                    p[u] = bit
+            lows = [low[v] for v in lower]
+            for bit, u, bottom in zip(gg, upper, lows):
+                g[u] = bit
+                low[u] = bottom
+        carries = Bus.merge([i.cin] + g[:-1])
+        s = XOR(a=propagate.y, b=carries)
+        self.set_outputs(s=s.y, cout=g[-1])
+
+
+class KoggeStone(PrefixAdder):
+    """
+    Kogge-Stone prefix adder: log2(n) levels, every node combined at every level.
+    Fewest levels and fanout of 2, at the cost of n log2(n) cells
+    """
+    def levels(self, n):
+        levels = []
+        d = 1
+        while d < n:
+            levels.append([(i, i - d) for i in range(d, n)])
+            d *= 2
+        return levels
+
+
+class BrentKung(PrefixAdder):
+    """
+    Brent-Kung prefix adder: an up-sweep computes the groups of nodes 2**k - 1,
+    a down-sweep fills in the others. 2 log2(n) - 1 levels and fewer than 2n cells
+    """
+    def levels(self, n):
+        levels = []
+        d = 1
+        while d < n:
+            levels.append([(i, i - d) for i in range(2 * d - 1, n, 2 * d)])
+            d *= 2
+        d //= 2
+        while d > 1:
+            d //= 2
+            level = [(i, i - d) for i in range(3 * d - 1, n, 2 * d)]
+            if level:
+                levels.append(level)
+        return [level for level in levels if level]
+
+
+class CarryLookahead(PrefixAdder):
+    """
+    Multilevel carry-lookahead adder. Carries are looked ahead within blocks of
+    block bits (4 by default), the block generates and propagates are looked ahead
+    the same way one level up and so on; carries into the blocks are then fed back
+    down to the bits of each block. Levels grow with 2 log(n) in base block
+    """
+    def __init__(self, block=4, **kwargs):
+        if block < 2:
+            raise ValueError('Lookahead blocks must have at least 2 bits')
+        self.block = block
+        super().__init__(**kwargs)
+
+    def levels(self, n):
+        return self._lookahead(list(range(n)))
+
+    def _lookahead(self, nodes):
+        """Return the levels which complete the groups of nodes, down to nodes[0]"""
+        if len(nodes) < 2:
+            return []
+        blocks = [nodes[k:k + self.block] for k in range(0, len(nodes), self.block)]
+        levels = []
+        for block in blocks:
+            d = 1
+            for depth in range(len(block)):
+                if d >= len(block):
+                    break
+                cells = [(block[k], block[k - d]) for k in range(d, len(block))]
+                if depth == len(levels):
+                    levels.append([])
+                levels[depth].extend(cells)
+                d *= 2
+        levels += self._lookahead([block[-1] for block in blocks])
+        fix = [(node, blocks[k - 1][-1]) for k in range(1, len(blocks)) for node in blocks[k][:-1]]
+        if fix:
+            levels.append(fix)
+        return levels
+
+
+class AdderMixin:
+    """
+    Mixin for blocks which are built around an adder. adder is the adder class,
+    CPA or a PrefixAdder, either a class attribute or given as a kwarg
+    """
+    adder = CPA
+
+    def __init__(self, adder=None, **kwargs):
+        if adder is not None:
+            self.adder = adder
+        super().__init__(**kwargs)
+
+
 class Subtractor(BaseCircuit):
     """
     
@@ -225,7 +403,11 @@ class EqualityComparator(BaseCircuit):
         i = self.get_inputs()
         compare = XOR(a=i.a, b=i.b, bubbles=['y'])
         buses = compare.y.split()
-        ender = AND(inputs=len(buses))
+        if len(buses) == 1:
+            self.set_outputs(eq=compare.y)
+            return
+        #the bits of the XNOR are reduced by the tree of nGate, in log2(size) levels
+        ender = AND(inputs=len(buses), size=1)
         ender.connect_sequence(buses)
         self.set_outputs(eq=ender.y)
 
@@ -253,6 +435,38 @@ class Comparator(BaseCircuit):
 
 
 
+class SharedComparator(AdderMixin, BaseCircuit):
+    """
+    Comparator with the interface of Comparator whose outputs all derive from a
+    single subtraction, a - b, and a zero detect of the difference. Comparisons
+    are unsigned: the carry out of a + ~b + 1 is set when a >= b.
+    Comparator needs a CPA for each of lt, gte, gt and lte, two XOR planes and
+    its MSB comparisons only hold while a - b fits in the word.
+    Outputs are settled as it's made, see settle_outputs.
+    """
+    input_labels = 'a b'.split()
+    output_labels = 'neq eq lte gt gte lt'.split()
+    sizes = {label:1 for label in output_labels}
+
+    def make(self):
+        i = self.get_inputs()
+        difference = self.adder(a=i.a, b=i.b, cin=Bus.vdd(), bubbles=['b'])
+        bits = difference.s.split()
+        if len(bits) == 1:
+            nonzero = difference.s
+        else:
+            any_bit = OR(inputs=len(bits), size=1)
+            any_bit.connect_sequence(bits)
+            nonzero = any_bit.y
+        gte = difference.cout
+        eq = INV(a=nonzero)
+        lt = INV(a=gte)
+        gt = AND(a=gte, b=nonzero)
+        lte = AND(a=gte, b=nonzero, bubbles=['y'])
+        self.set_outputs(eq=eq.y, neq=nonzero, gte=gte, lt=lt.y, gt=gt.y, lte=lte.y)
+        self.settle_outputs()
+
+
 class BaseDecoder(BaseCircuit):
     """
     
@@ -283,11 +497,20 @@ class Decoder(BaseCircuit):
         else: y_size = 2
         self.output_labels = ['y'+str(i) for i in range(y_size)]
         self.sizes.update({label:1 for label in self.output_labels})
+        self._y = None
         super().__init__(**kwargs)
 
     @property
     def y(self):
-        return Bus.merge(self.get_buses(self.output_labels))
+        """Bus made up by all outputs, y0 is the LSB. Built once, discarded whenever
+        the decoder is rewired"""
+        if self._y is None:
+            self._y = Bus.merge(self.get_buses(self.output_labels))
+        return self._y
+
+    def update_triggers(self):
+        self._y = None
+        super().update_triggers()
 
     def make(self):
         """Recursive implementation inspired by implementation at
@@ -304,6 +527,75 @@ class Decoder(BaseCircuit):
             self.set_outputs(**y_buses)
 
 
+class PredecodedDecoder(Decoder):
+    """
+    Decoder with shared predecoding. The address is split in halves, each half is
+    predecoded once (recursively, the same way) and every output is the AND of a
+    line of each half, so a level is a single AND plane. e gates the lines of the
+    lower half. About 2**n two input ANDs instead of n * 2**n.
+    """
+    def make(self):
+        i = self.get_inputs()
+        size = self.sizes['a']
+        half = size // 2 or 1
+        low = self.predecode(i.a[:half])
+        lines = AND(a=Bus.merge(low), b=i.e.branch(len(low))).y.split()
+        if size > half:
+            lines = self.plane(lines, self.predecode(i.a[half:]))
+        self.set_outputs(**{'y'+str(k) : line for k, line in enumerate(lines)})
+
+    @classmethod
+    def predecode(cls, a):
+        """Return the one-hot lines of a, line k is high when a is k"""
+        if len(a) == 1:
+            return [INV(a=a).y, a]
+        half = len(a) // 2
+        return cls.plane(cls.predecode(a[:half]), cls.predecode(a[half:]))
+
+    @staticmethod
+    def plane(low, high):
+        """AND plane of every line of low with every line of high, low lines vary fastest"""
+        gate = AND(a=Bus.merge(low * len(high)), b=Bus.merge(line for line in high for _ in low))
+        return gate.y.split()
+
+
+class BehavioralDecoder(BehavioralCircuit, Decoder):
+    """
+    Behavioral model of Decoder. Updates only write the outputs which change,
+    the line selected before and the one selected now
+    """
+    def __init__(self, **kwargs):
+        self._selected = None
+        super().__init__(**kwargs)
+
+    def function(self, a, e):
+        y = dict.fromkeys(self.output_labels, 0)
+        if e.value:
+            y['y'+str(a.value)] = 1
+        return y
+
+    def update(self):
+        terminals = self.terminals
+        a, e = terminals['a'], terminals['e']
+        a.propagate()
+        e.propagate()
+        a, e = a.y.signal, e.y.signal
+        previous = self._selected
+        if a.unknown or e.unknown or previous is None:
+            self._selected = None if a.unknown or e.unknown else (a.value if e.value else -1)
+            super().update()
+            return
+        selected = a.value if e.value else -1
+        if selected == previous:
+            return
+        self._selected = selected
+        for line, bit in ((previous, 0), (selected, 1)):
+            if line >= 0:
+                terminal = terminals['y'+str(line)]
+                terminal.a.signal = bit
+                terminal.propagate()
+
+
 class ROM(BaseCircuit):
     """
     Implementation of ROM. Use burn_rom method to assign values to rom.
@@ -312,6 +604,7 @@ class ROM(BaseCircuit):
     """
     input_labels = "addr ce".split()
     output_labels = "q".split()
+    decoder = PredecodedDecoder
     def __init__(self, word_size, **kwargs):
         self.word_size = word_size
         self.sizes = dict(q=word_size, ce=1)
@@ -319,14 +612,12 @@ class ROM(BaseCircuit):
 
     def make(self):
         i = self.get_inputs()
-        W_bus = i.q
-        addr_decoder = Decoder(a=i.addr, e=Bus.vdd())
+        W_bus = i.q.resolve()
+        addr_decoder = self.decoder(a=i.addr, e=Bus.vdd())
         self.set_tristate(q=i.ce)
         words = len(addr_decoder.y)
-        self.cells = [OR(size=self.word_size) for _ in range(words)]
-        for cell, bus in zip(self.cells, addr_decoder.y):
-            cell.set_tristate(y=bus)
-            cell.connect(y=W_bus)
+        cell = Gate.prototype(Gate.OR, b=Bus.gnd(self.word_size))
+        self.cells = cell.instantiate(words, tristate=dict(y=addr_decoder.y.split()), y=W_bus)
 
     def fburn(self, f):
         """Call IOHelper on f to open a file and get the memory contents
@@ -0,0 +1,334 @@
+"""
+Compilation of an elaborated circuit hierarchy into flat arrays of gates.
+
+A compiled circuit no longer goes through BaseCircuit, Terminal and Bus objects
+when simulated. Each wire becomes a net index and every gate bit becomes an entry
+in a set of parallel arrays: op code, input nets, output net, bubble flags and
+enable net. Terminals of composite circuits are compiled as buffers.
+"""
+from array import array
+from collections import deque
+from pdd.core import Signal, WireStore
+from pdd.dl import BaseCircuit
+from pdd.combinational_blocks import Gate, PrimitiveGate
+from pdd.tools import TruthTable
+
+AND, OR, XOR, BUF = range(4)
+GND, VDD = 0, 1
+
+#bubble flags
+BUBBLE_A = 1
+BUBBLE_B = 2
+BUBBLE_Y = 4
+
+
+class CompiledCircuit:
+    """
+    Flat gate array representation of circuit.
+
+    Nets are indexed by the order in which their wires are found, nets 0 and 1
+    are GND and VDD as in the WireStore. Net values start as the values of the
+    wires in circuit, therefore the compiled circuit carries on from the state
+    of circuit. Buffers are evaluated once after compilation, as the composite
+    circuits they come from would on their next update.
+
+    Gates are compiled with their terminals folded in, whenever the input terminals
+    have no enable. Wires inside such gates don't get a net, every other wire in
+    the hierarchy does. n input PrimitiveGates are compiled as balanced trees of
+    operations, whose inner nodes get nets of their own, not backed by wires.
+
+    Use apply to assign signals to the input terminals of circuit, read to get the
+    signal of a Bus and sync to copy net values back into the wires of circuit.
+    sweep generates the truth table of combinational circuits bit-parallel.
+    """
+    ops_codes = {Gate.AND : AND, Gate.OR : OR, Gate.XOR : XOR}
+
+    def __init__(self, circuit, threshold=2**20):
+        self.circuit = circuit
+        self.store = circuit.sim.store
+        if self.store.four_state:
+            raise TypeError('Can not compile a four-state circuit')
+        self.threshold = threshold
+        self.nets = {}
+        self.wires = [GND, VDD]
+        self.values = bytearray([0, 1])
+        self.ops = array('B')
+        self.a = array('l')
+        self.b = array('l')
+        self.y = array('l')
+        self.bubbles = array('B')
+        self.en = array('l')
+        for block in circuit.walk():
+            if isinstance(block, Gate):
+                self._compile_gate(block)
+            elif isinstance(block, PrimitiveGate):
+                self._compile_primitive(block)
+            elif type(block).update is BaseCircuit.update:
+                for terminal in block.terminals.values():
+                    self._compile_terminal(terminal)
+            else:
+                raise TypeError('Can not compile circuit {}'.format(type(block).__name__))
+        self.fanout = [[] for _ in self.values]
+        for i in range(len(self.ops)):
+            inputs = {self.a[i], self.en[i]}
+            if self.ops[i] != BUF:
+                inputs.add(self.b[i])
+            for net in inputs:
+                self.fanout[net].append(i)
+        self._evaluate([i for i, op in enumerate(self.ops) if op == BUF])
+
+    def __len__(self):
+        return len(self.ops)
+
+    def net(self, wire):
+        """Return the net index of the wire at index wire, allocating it if needed"""
+        if wire <= WireStore.VDD:
+            return wire
+        try:
+            return self.nets[wire]
+        except KeyError:
+            index = len(self.values)
+            self.nets[wire] = index
+            self.wires.append(wire)
+            self.values.append(self.store.bits[wire])
+            return index
+
+    def _add(self, op, a, b, y, bubbles, en):
+        """Append an operation to the arrays. Operations driving a constant net are dropped"""
+        if y in (GND, VDD):
+            return
+        self.ops.append(op)
+        self.a.append(a)
+        self.b.append(b)
+        self.y.append(y)
+        self.bubbles.append(bubbles)
+        self.en.append(en)
+
+    def _compile_terminal(self, terminal):
+        if terminal.flattened:
+            return
+        en = self.net(terminal.en.indexes[0])
+        bubbles = BUBBLE_Y if terminal.bubble else 0
+        for a, y in zip(terminal.a.indexes, terminal.y.indexes):
+            self._add(BUF, self.net(a), GND, self.net(y), bubbles, en)
+
+    def _compile_gate(self, gate):
+        op = self.ops_codes[gate.op]
+        inputs = [gate.terminals['a'], gate.terminals['b']]
+        bubbles = 0
+        for flag, terminal in zip((BUBBLE_A, BUBBLE_B), inputs):
+            if self.net(terminal.en.indexes[0]) == VDD:
+                bubbles |= flag if terminal.bubble else 0
+            else:
+                self._compile_terminal(terminal)
+        a_wires, b_wires = [t.a.indexes if self.net(t.en.indexes[0]) == VDD else t.y.indexes
+                            for t in inputs]
+        out = gate.terminals['y']
+        bubbles |= BUBBLE_Y if out.bubble else 0
+        en = self.net(out.en.indexes[0])
+        for a, b, y in zip(a_wires, b_wires, out.y.indexes):
+            self._add(op, self.net(a), self.net(b), self.net(y), bubbles, en)
+
+    def _compile_primitive(self, gate):
+        op = self.ops_codes[gate.op]
+        operands = []
+        for label in gate.input_labels:
+            terminal = gate.terminals[label]
+            if self.net(terminal.en.indexes[0]) == VDD and not terminal.bubble:
+                operands.append([self.net(a) for a in terminal.a.indexes])
+            else:
+                self._compile_terminal(terminal)
+                operands.append([self.net(y) for y in terminal.y.indexes])
+        out = gate.terminals['y']
+        while len(operands) > 2:
+            pairs = len(operands) // 2
+            nodes = [[self._node() for _ in operands[0]] for _ in range(pairs)]
+            for a_nets, b_nets, y_nets in zip(operands[::2], operands[1::2], nodes):
+                for a, b, y in zip(a_nets, b_nets, y_nets):
+                    self._add(op, a, b, y, 0, VDD)
+            operands = nodes + operands[2 * pairs:]
+        bubbles = BUBBLE_Y if out.bubble else 0
+        en = self.net(out.en.indexes[0])
+        for a, b, y in zip(operands[0], operands[1], out.y.indexes):
+            self._add(op, a, b, self.net(y), bubbles, en)
+
+    def _node(self):
+        """Return a new net which isn't backed by a wire"""
+        self.wires.append(None)
+        self.values.append(0)
+        return len(self.values) - 1
+
+    def nets_of(self, bus):
+        """Return the list of net indexes for bus"""
+        return [self.net(index) for index in bus.indexes]
+
+    def read(self, bus):
+        """Return the Signal carried by bus in the compiled circuit"""
+        nets = self.nets_of(bus)
+        value = 0
+        for i, net in enumerate(nets):
+            value |= self.values[net] << i
+        return Signal(value, len(nets))
+
+    def write(self, bus, value):
+        """Assign value (int or Signal) to bus and settle the compiled circuit"""
+        self.settle(self._assign(bus, value))
+
+    def apply(self, **signals):
+        """Assign signals to the input terminals of circuit by label and settle once"""
+        changed = []
+        for label, value in signals.items():
+            changed += self._assign(self.circuit.get_bus(label), value)
+        self.settle(changed)
+
+    def _assign(self, bus, value):
+        """Set the nets of bus to value, return the nets that changed"""
+        value = int(value)
+        changed = []
+        for i, net in enumerate(self.nets_of(bus)):
+            bit = value >> i & 0x1
+            if self.values[net] != bit:
+                if net in (GND, VDD):
+                    raise TypeError('StaticWire does not support assignment')
+                self.values[net] = bit
+                changed.append(net)
+        return changed
+
+    def settle(self, nets):
+        """Evaluate the operations reading nets until no net changes.
+        Raise RuntimeError if threshold evaluations are exceeded"""
+        fanout = self.fanout
+        self._evaluate(dict.fromkeys(i for net in nets for i in fanout[net]))
+
+    def _evaluate(self, initial):
+        """Evaluate the operations in initial and every operation reading a net they
+        change, until no net changes"""
+        ops, a, b, y, bubbles, en = self.ops, self.a, self.b, self.y, self.bubbles, self.en
+        values, fanout = self.values, self.fanout
+        queued = bytearray(len(ops))
+        queue = deque(initial)
+        for i in queue:
+            queued[i] = 1
+        for _ in range(self.threshold):
+            if not queue:
+                return
+            i = queue.popleft()
+            queued[i] = 0
+            if not values[en[i]]:
+                continue
+            flags = bubbles[i]
+            value = values[a[i]] ^ (flags & BUBBLE_A)
+            op = ops[i]
+            if op != BUF:
+                other = values[b[i]] ^ (flags >> 1 & 0x1)
+                if op == AND:
+                    value &= other
+                elif op == OR:
+                    value |= other
+                else:
+                    value ^= other
+            value ^= flags >> 2
+            out = y[i]
+            if values[out] != value:
+                values[out] = value
+                for j in fanout[out]:
+                    if not queued[j]:
+                        queued[j] = 1
+                        queue.append(j)
+        raise RuntimeError('Compiled circuit did not settle; check for cyclic path.')
+
+    def levelized(self):
+        """Return the operation indexes sorted so that every operation comes after
+        the operations driving its inputs. Raise ValueError for cyclic circuits"""
+        drivers = [[] for _ in self.values]
+        for i, out in enumerate(self.y):
+            drivers[out].append(i)
+        pending = []
+        for i in range(len(self.ops)):
+            inputs = {self.a[i], self.en[i]}
+            if self.ops[i] != BUF:
+                inputs.add(self.b[i])
+            pending.append(sum(len(drivers[net]) for net in inputs))
+        order = [i for i, n in enumerate(pending) if n == 0]
+        for i in order:
+            for j in self.fanout[self.y[i]]:
+                pending[j] -= 1
+                if pending[j] == 0:
+                    order.append(j)
+        if len(order) != len(self.ops):
+            raise ValueError('Circuit has cyclic paths, it must be combinational')
+        return order
+
+    def sweep(self):
+        """Return the TruthTable of circuit over all of its input values.
+
+        All 2 ** n input vectors are evaluated at once: each net carries an integer
+        whose k-th bit is the value of the net for the k-th input vector, so the
+        netlist is evaluated in a single pass in level order. Nets which aren't
+        driven for some vector (tri-state) keep their current value.
+        Rows are formatted as in BaseCircuit.state_int."""
+        circuit = self.circuit
+        inputs = [(label, self.nets_of(circuit.get_bus(label))) for label in circuit.input_labels]
+        outputs = [(label, self.nets_of(circuit.get_bus(label))) for label in circuit.output_labels]
+        n = sum(len(nets) for _, nets in inputs)
+        vectors = 2 ** n
+        mask = 2 ** vectors - 1
+        values = [mask if value else 0 for value in self.values]
+        j = 0
+        for _, nets in inputs:
+            for net in nets:
+                values[net] = self._vector_bit(j, vectors)
+                j += 1
+        ops, a, b, y, bubbles, en = self.ops, self.a, self.b, self.y, self.bubbles, self.en
+        for i in self.levelized():
+            flags = bubbles[i]
+            value = values[a[i]] ^ (mask if flags & BUBBLE_A else 0)
+            op = ops[i]
+            if op != BUF:
+                other = values[b[i]] ^ (mask if flags & BUBBLE_B else 0)
+                if op == AND:
+                    value &= other
+                elif op == OR:
+                    value |= other
+                else:
+                    value ^= other
+            if flags & BUBBLE_Y:
+                value ^= mask
+            enable = values[en[i]]
+            values[y[i]] = value & enable | values[y[i]] & (mask ^ enable)
+        columns = {label : [format(values[net], '0{}b'.format(vectors)) for net in reversed(nets)]
+                   for label, nets in outputs}
+        rows = []
+        for k in range(vectors):
+            row = {}
+            shift = 0
+            for label, nets in inputs:
+                row[label] = k >> shift & (2 ** len(nets) - 1)
+                shift += len(nets)
+            for label, bits in columns.items():
+                row[label] = int(''.join(column[-k-1] for column in bits), 2)
+            rows.append(row)
+        return TruthTable(rows)
+
+    @staticmethod
+    def _vector_bit(j, vectors):
+        """Return the integer whose k-th bit is the j-th bit of k, for k < vectors"""
+        width = 2 ** (j + 1)
+        value = (2 ** (width // 2) - 1) << (width // 2)
+        while width < vectors:
+            value |= value << width
+            width *= 2
+        return value & (2 ** vectors - 1)
+
+    def sync(self):
+        """Copy net values into the wires of the original circuit, without generating
+        events, so results can be read through the original Bus objects"""
+        bits = self.store.bits
+        for wire, value in zip(self.wires[2:], self.values[2:]):
+            if wire is not None:
+                bits[wire] = value
+
+
+def compile(circuit, threshold=2**20):
+    """Compile circuit into a CompiledCircuit"""
+    return CompiledCircuit(circuit, threshold)
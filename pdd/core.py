@@ -1,63 +1,239 @@
 """Module containg abstractions which are used to implement digital logic. The objects in this module aren't physical entities as much as concepts in digital logic"""
 
-from collections import defaultdict, namedtuple, deque
-import logging
+from collections import deque
+from contextlib import contextmanager
+import gc, heapq, itertools, logging, math, threading, weakref
 
 logger = logging.getLogger(__name__)
 
+class WireStore:
+    """
+    WireStore holds the state of wires. The bit of every wire lives in a single
+    bytearray and wires are identified by their index in it.
+
+    Indexes 0 and 1 are reserved for GND and VDD, the static wires.
+    Changes made through drive are notified to updater.
+
+    In four_state stores wires also take the Z and X states: bit 0 of a wire is its
+    value and bit 1 is set for unknown states, as in Signal. New wires are X.
+
+    Wires may be resolved nets, driven by several tri-state drivers. drivers maps
+    the index of each resolved wire to the bits of its active drivers, by the id of
+    the driver so the store keeps no driver alive, and the
+    wire is set to their OR (four_state: to their common bit, X if they differ).
+    Resolved wires with no active driver keep their bit (four_state: float to Z).
+    Wires with more than one active driver are in conflicts.
+    resolutions counts the calls to resolve, drivers check it to find out whether
+    the wires they drive became resolved.
+
+    Wires given back by release (see BaseCircuit.discard) are kept in free, as
+    ranges, and reused by alloc. While log is a list, the ranges allocated are
+    appended to it. allocated counts the wires ever allocated.
+    """
+    GND = 0
+    VDD = 1
+    Z = 2
+    X = 3
+    _ascii = bytes.maketrans(b'\x00\x01\x02\x03', b'0101')
+    _unknown_ascii = bytes.maketrans(b'\x00\x01\x02\x03', b'0011')
+    def __init__(self, updater=None, four_state=False):
+        self.bits = bytearray([0, 1])
+        self.updater = updater
+        self.four_state = four_state
+        self.drivers = {}
+        self.conflicts = set()
+        self.resolutions = 0
+        self.free = []
+        self.log = None
+        self.allocated = 0
+
+    def __len__(self):
+        return len(self.bits)
+
+    def alloc(self, n, bit=None):
+        """Allocate n wires set to bit, return the range of their indexes.
+        By default wires are 0, X in four_state stores. Released wires are
+        reused first"""
+        if bit is None:
+            bit = self.X if self.four_state else 0
+        for i, free in enumerate(self.free):
+            if len(free) >= n:
+                start = free.start
+                if len(free) == n:
+                    del self.free[i]
+                else:
+                    self.free[i] = range(start + n, free.stop)
+                self.bits[start:start + n] = bytes([bit]) * n
+                break
+        else:
+            start = len(self.bits)
+            self.bits.extend(bytes([bit]) * n)
+        self.allocated += n
+        indexes = range(start, start + n)
+        log = self.log
+        if log is not None and n:
+            if log and log[-1].stop == start:
+                log[-1] = range(log[-1].start, start + n)
+            else:
+                log.append(indexes)
+        return indexes
+
+    def release(self, indexes):
+        """Give the wires at indexes back to the store, to be reused by alloc.
+        They must no longer be read nor driven"""
+        for index in indexes:
+            self.drivers.pop(index, None)
+            self.conflicts.discard(index)
+        runs = self.free + [range(index, index + 1) for index in set(indexes)]
+        free = []
+        for run in sorted(runs, key=lambda run: run.start):
+            if free and free[-1].stop == run.start:
+                free[-1] = range(free[-1].start, run.stop)
+            else:
+                free.append(run)
+        self.free = free
+
+    def pack(self, indexes):
+        """Return an integer whose i-th bit is the bit of the wire at indexes[i].
+        Contiguous ranges of wires are packed straight from a slice of the store"""
+        bits = self.bits
+        if type(indexes) is range and indexes.step == 1 and len(indexes) > 1:
+            chunk = bits[indexes.start:indexes.stop]
+            return int(chunk.translate(self._ascii)[::-1], 2)
+        value = 0
+        if self.four_state:
+            for i, index in enumerate(indexes):
+                value |= (bits[index] & 0x1) << i
+            return value
+        for i, index in enumerate(indexes):
+            value |= bits[index] << i
+        return value
+
+    def pack_unknown(self, indexes):
+        """Return an integer whose i-th bit is set if the wire at indexes[i] is X or Z"""
+        if not self.four_state:
+            return 0
+        bits = self.bits
+        if type(indexes) is range and indexes.step == 1 and len(indexes) > 1:
+            chunk = bits[indexes.start:indexes.stop]
+            return int(chunk.translate(self._unknown_ascii)[::-1], 2)
+        value = 0
+        for i, index in enumerate(indexes):
+            value |= (bits[index] >> 1) << i
+        return value
+
+    def drive(self, index, value):
+        """Set the bit of the wire at index to value. Upon change the updater is
+        notified and, if its auto_update is set, updated"""
+        bits = self.bits
+        if bits[index] == value:
+            return
+        if index <= self.VDD:
+            e = TypeError('StaticWire does not support assignment')
+            logger.exception(e)
+            raise e
+        bits[index] = value
+        updater = self.updater
+        if updater.tracer is not None:
+            updater.tracer.wire_changed(index, value)
+        updater.notify(index)
+        if not updater.updating and updater.auto_update:
+            updater.update()
+
+    def resolve(self, indexes):
+        """Turn the wires at indexes into resolved nets"""
+        for index in indexes:
+            if index <= self.VDD:
+                raise TypeError('Static wires can not be resolved')
+            if self.drivers.setdefault(index, {}) == {} and self.four_state:
+                self.drive(index, self.Z)
+        self.resolutions += 1
+
+    def contribute(self, index, driver, bit):
+        """Set the bit driven by driver into the resolved wire at index, None
+        withdraws driver, as does driving Z. The wire is then resolved from its
+        active drivers"""
+        drivers = self.drivers[index]
+        if bit is None or bit == self.Z:
+            drivers.pop(id(driver), None)
+        else:
+            drivers[id(driver)] = bit
+        if len(drivers) > 1:
+            self.conflicts.add(index)
+        else:
+            self.conflicts.discard(index)
+        if not self.four_state:
+            if drivers:
+                self.drive(index, 1 if 1 in drivers.values() else 0)
+        elif not drivers:
+            self.drive(index, self.Z)
+        else:
+            values = set(drivers.values())
+            self.drive(index, values.pop() if len(values) == 1 else self.X)
+
+
 class Wire:
     """
     Wire represents a bit of data. Changes to Wire create Events which
-    are notified to updater.
+    are notified to updater. Events are the indexes of the changed wires.
 
-    Wires are immutable therefore they are the correct candidates for event
-    generation.
+    Wire is a lightweight handle to a bit in a WireStore, the same wire may
+    have many handles. Wire() allocates a new wire in the store of the
+    current Simulation, unless store is given.
     
-    Wire must be assigned an instance of Updater before use.
-    If auto_update is True, Wire will call updater.update() every time
-    a set is made
+    If the auto_update of the updater is True, Wire will call updater.update()
+    every time a set is made
     """
-    Event = namedtuple('Event', ('obj'))
-    updater = None
-    auto_update = True
-    def __init__(self, bit=0):
-        self._bit = 0
+    __slots__ = ('index', 'store')
+    def __init__(self, bit=0, store=None):
+        self.store = store if store is not None else Simulation.current().store
+        self.index = self.store.alloc(1)[0]
         self.bit = bit
 
+    @classmethod
+    def handle(cls, index, store):
+        """Return a handle for the wire at index in store"""
+        wire = object.__new__(cls)
+        wire.index = index
+        wire.store = store
+        return wire
+
     def __repr__(self):
-        s = '{}: bit={}; id={}'
-        return s.format(self.__class__, self.bit, id(self))
+        s = '{}: bit={}; index={}'
+        return s.format(self.__class__, self.bit, self.index)
+
+    def __eq__(self, other):
+        return isinstance(other, Wire) and self.index == other.index and self.store is other.store
+
+    def __hash__(self):
+        return hash(self.index)
 
     @property
-    def bit(self):
-        return self._bit
-    
-    def __repr__(self):
-        s = '{}: bit={}; id={}'
-        return s.format(self.__class__, self.bit, id(self))
+    def updater(self):
+        return self.store.updater
 
+    @property
+    def bit(self):
+        return self.store.bits[self.index]
 
     @bit.setter
     def bit(self, value):
-        if self._bit == value:
-            return
-        self._bit = value
-        event = self.Event(self)
-        self.updater.notify(event)
-        if not self.updater.updating and self.auto_update:
-            self.updater.update()
+        self.store.drive(self.index, value)
         
-class StaticWire:
+class StaticWire(Wire):
     """
     Like wire but does not support assignment.
-    Used exclusively for Bus.vdd and Bus.gnd.
+    Used exclusively for Bus.vdd and Bus.gnd, its a handle for the
+    reserved GND or VDD index.
     """
-    def __init__(self, bit):
-        self._bit = bit
+    __slots__ = ()
+    def __init__(self, bit, store=None):
+        self.store = store if store is not None else Simulation.current().store
+        self.index = WireStore.VDD if bit else WireStore.GND
 
     @property
     def bit(self):
-        return self._bit
+        return self.store.bits[self.index]
     
     @bit.setter
     def bit(self, value):
@@ -71,71 +247,205 @@ class Signal:
     Signal provides an API to deal with digital signals. The data carried by
     a Bus is encoded as a Signal. Signal provides methods to perform logical operations
     that take Signal objects as operands and return a new instace of Signal.
+
+    Four-state signals (0, 1, X and Z) carry a second bit-plane, unknown. Bits set in
+    unknown are X where the bit of value is 1 and Z where it is 0. Logic operations
+    treat Z inputs as X and propagate X, as long as it can affect their output.
+    Signals with no unknown bits are two-state, int(signal) is the value plane.
+
+    Signals are immutable. Two-state signals of up to interned_size bits are
+    interned, Signal(value, size) returns the same object for the same value and size.
     """
-    def __init__(self, value, size):
-        if type(value) is int:
-            self.value = value
-        else:
+    __slots__ = ('value', '_size', 'unknown', '_bits')
+    interned_size = 8
+    _masks = [(1 << i) - 1 for i in range(65)]
+    _small = []
+    _ascii = bytes.maketrans(b'01', b'\x00\x01')
+    _symbols = '01zx'
+    def __new__(cls, value, size, unknown=0):
+        if type(value) is not int:
             msg = 'Argument of type {} to {}. Must be an Integer'
-            e = TypeError(msg.format(type(value), self.__class__))
+            e = TypeError(msg.format(type(value), cls))
             logger.exception(e)
             raise e
-        self._size = size
-        logger.debug(repr(self))
+        if not unknown and size <= cls.interned_size and 0 <= value >> size == 0 and cls is Signal:
+            try:
+                return cls._small[size][value]
+            except IndexError:
+                pass
+        signal = object.__new__(cls)
+        object.__setattr__(signal, 'value', value)
+        object.__setattr__(signal, '_size', size)
+        object.__setattr__(signal, 'unknown', unknown)
+        return signal
+
+    def __setattr__(self, attr, value):
+        raise AttributeError('Signal is immutable')
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (self.value, self._size, self.unknown))
+
+    @classmethod
+    def mask(cls, size):
+        """Return the integer with the size lower bits set"""
+        try:
+            return cls._masks[size]
+        except IndexError:
+            return (1 << size) - 1
 
     @classmethod
     def from_wires(cls, wires):
         """Initialize a signal object from a list of wires"""
-        sig = 0
-        for i, wire in enumerate(wires):
-            sig |= wire.bit << i
-        return cls(sig, len(wires))
+        if not wires:
+            return cls(0, 0)
+        store = wires[0].store
+        indexes = [wire.index for wire in wires]
+        return cls(store.pack(indexes), len(wires), store.pack_unknown(indexes))
         
     @property
     def bits(self):
         """Convert value into a sequence of 0s and 1s, essentially
         a list with its binary representation.
-        The 0th element of the sequence represents the 0th bit."""
-        return tuple(self.value >> i & 0x1 for i in range(self._size))
+        The 0th element of the sequence represents the 0th bit.
+        Unknown bits are WireStore.Z or WireStore.X. bits is computed once per signal"""
+        try:
+            return self._bits
+        except AttributeError:
+            pass
+        size = self._size
+        if not size:
+            bits = ()
+        else:
+            digits = format(self.value & self.mask(size), '0{}b'.format(size))
+            bits = tuple(digits[::-1].encode().translate(self._ascii))
+        unknown = self.unknown
+        if unknown:
+            bits = tuple(bit | (unknown >> i & 0x1) << 1 for i, bit in enumerate(bits))
+        object.__setattr__(self, '_bits', bits)
+        return bits
+
+    @property
+    def known(self):
+        """True if no bit of the signal is X or Z"""
+        return not self.unknown
 
     def __eq__(self, other):
-        return self.value == other.value
+        return self.value == other.value and self.unknown == other.unknown
+
+    def __hash__(self):
+        return hash(self.value)
 
     def __repr__(self):
         s = '{}: value={};'
-        return s.format(self.__class__, hex(self.value))
+        return s.format(self.__class__, str(self))
         
     def __int__(self):
         return self.value
     
     def __str__(self):
-        return hex(self.value)
+        if not self.unknown:
+            return hex(self.value)
+        return '0b' + ''.join(self._symbols[bit] for bit in reversed(self.bits))
 
     def complement(self):
         return Signal.NOT(self)
+
+    @staticmethod
+    def _planes(a, mask):
+        """Return the known ones and known zeros of a"""
+        known = mask & ~a.unknown
+        return a.value & known, ~a.value & known
     
     @classmethod
     def NOT(cls, a):
-        mask = 0
-        for i in range(a._size):
-            mask |= 1 << i
+        mask = cls.mask(a._size)
+        unknown = a.unknown
         value = ~a.value & mask
-        return cls(value, a._size)
+        if unknown:
+            value = value & ~unknown | unknown
+        return cls(value, a._size, unknown)
 
     @classmethod
     def OR(cls, a, b):
-        value = a.value | b.value
-        return cls(value, a._size)
+        if not (a.unknown or b.unknown):
+            return cls(a.value | b.value, a._size)
+        mask = cls.mask(a._size)
+        a1, a0 = cls._planes(a, mask)
+        b1, b0 = cls._planes(b, mask)
+        ones = a1 | b1
+        unknown = mask & ~(ones | a0 & b0)
+        return cls(ones | unknown, a._size, unknown)
 
     @classmethod
     def AND(cls, a, b):
-        value = a.value & b.value
-        return cls(value, a._size)
+        if not (a.unknown or b.unknown):
+            return cls(a.value & b.value, a._size)
+        mask = cls.mask(a._size)
+        a1, a0 = cls._planes(a, mask)
+        b1, b0 = cls._planes(b, mask)
+        ones = a1 & b1
+        unknown = mask & ~(ones | a0 | b0)
+        return cls(ones | unknown, a._size, unknown)
 
     @classmethod
     def XOR(cls, a, b):
-        value = a.value ^ b.value
-        return cls(value, a._size)
+        if not (a.unknown or b.unknown):
+            return cls(a.value ^ b.value, a._size)
+        mask = cls.mask(a._size)
+        unknown = (a.unknown | b.unknown) & mask
+        value = (a.value ^ b.value) & ~unknown | unknown
+        return cls(value, a._size, unknown)
+
+Signal._small = [[Signal(value, size) for value in range(1 << size)]
+                 for size in range(Signal.interned_size + 1)]
+for signals in Signal._small:
+    for signal in signals:
+        signal.bits
+del signals, signal
+
+class Tracer:
+    """
+    Callback protocol for tracing a simulation, see Updater.tracer.
+    Subclasses override the callbacks they are interested in.
+    """
+    def wire_changed(self, index, bit):
+        """The wire at index was set to bit"""
+        pass
+
+    def event_queued(self, index):
+        """An event for the wire at index was queued"""
+        pass
+
+    def circuit_evaluated(self, circuit):
+        """circuit was updated by the updater"""
+        pass
+
+    def make_started(self, circuit):
+        """circuit is being built, ie. BaseCircuit.__init__ started"""
+        pass
+
+    def make_finished(self, circuit):
+        """circuit was built: its terminals, make and subscriptions are done"""
+        pass
+
+
+class Subscription(weakref.ref):
+    """Weak reference to a subscriber of Updater. Holds the wire indexes the
+    subscriber is subscribed to and its rank, None while unranked"""
+    __slots__ = ('key', 'wires', 'rank')
+
+    def __init__(self, unit, callback=None):
+        super().__init__(unit, callback)
+        self.key = id(unit)
+        self.wires = set()
+        self.rank = None
+
 
 class Updater:
     """
@@ -147,70 +457,384 @@ class Updater:
     subscribe to Updater to be updated upon Wire changes.
 
     Handling events, presumably, begins a cascate of events by making changes
-    to others Wires which notifies of further events. Updater's job for the cycle
+    to others Wires which notifies of further events. Events are handled in delta
+    cycles: all events queued by one delta are handled together in the next, so
+    a circuit is updated at most once per delta. Updater's job for the cycle
     is done when no new events are generated by an update call.
 
-    There is a maximum threshold (default 2**10, change within init) to Updater's number 
-    of calls per cycle in order to avoid deadlocks caused by improper circuits
+    There is a maximum threshold (default 2**16, change within init) to Updater's number 
+    of deltas per cycle in order to avoid deadlocks caused by improper circuits
     (e.g. unstable circuits or circuits with cyclic paths)
+
+    If a Tracer is assigned to tracer, it is called back as wires change, events
+    are queued and circuits are evaluated.
+
+    auto_update is per updater: while it is False wire changes are only queued,
+    until update is called.
+
+    Subscriptions are kept in relations, which maps wire indexes to the
+    Subscriptions (weak references) of their subscribers. Updater doesn't keep
+    subscribers alive, once collected their subscriptions are dropped.
     """
     def __init__(self, threshold=2**16):
         logger.info('Updater object created')
         self.auto_update = True
         self.threshold = threshold
         self.updating = False
-        self.events = []
-        self.relations = defaultdict(list)
+        self.events = deque()
+        self.tracer = None
+        self.relations = {}
+        self.refs = {}
+        self.collected = []
 
+    def reference(self, unit):
+        """Return the Subscription of unit, creating it if needed"""
+        ref = self.refs.get(id(unit))
+        if ref is None or ref() is not unit:
+            ref = Subscription(unit, self.collected.append)
+            self.refs[id(unit)] = ref
+        return ref
 
     def subscribe(self, circuit, wires):
         """The subscribed circuit will be updater when an event is sourced by 
-any wire in wires"""
-        logger.debug('Subscribed {} to {}'.format(circuit, len(wires)))
+any wire in wires. wires is a sequence of wire indexes"""
+        if self.collected:
+            self.purge()
+        ref = self.reference(circuit)
+        relations = self.relations
         for wire in wires:
-            self.relations[id(wire)].append(circuit)
+            try:
+                relations[wire][ref] = None
+            except KeyError:
+                relations[wire] = {ref : None}
+        ref.wires.update(wires)
 
     def unsubscribe(self, circuit, wires):
         """Circuit will no longer be updated upon change made to wire in wires"""
+        ref = self.refs.get(id(circuit))
+        if ref is None or ref() is not circuit:
+            return
+        self._drop(ref, wires)
+
+    def forget(self, unit):
+        """Drop every subscription of unit"""
+        ref = self.refs.get(id(unit))
+        if ref is None or ref() is not unit:
+            return
+        self._drop(ref, list(ref.wires))
+        del self.refs[id(unit)]
+
+    def _drop(self, ref, wires):
+        """Remove ref from the subscribers of wires"""
+        relations = self.relations
         for wire in wires:
-            logger.debug('Unsubscribed {} from {}'.format(circuit, len(wires)))
-            try:
-                self.relations[id(wire)].remove(circuit)
-            except ValueError:
-                pass
+            subscribers = relations.get(wire)
+            if subscribers is not None:
+                subscribers.pop(ref, None)
+                if not subscribers:
+                    del relations[wire]
+        ref.wires.difference_update(wires)
+
+    def purge(self):
+        """Drop the subscriptions of garbage collected subscribers"""
+        collected = self.collected[:]
+        self.collected.clear()
+        for ref in collected:
+            self._drop(ref, list(ref.wires))
+            if self.refs.get(ref.key) is ref:
+                del self.refs[ref.key]
+
+    def subscribers(self, wire):
+        """Return the live subscribers of the wire at index wire"""
+        units = (ref() for ref in self.relations.get(wire, ()))
+        return [unit for unit in units if unit is not None]
+
+    def get_rank(self, unit):
+        """Return the logic level of unit, None if unit isn't ranked"""
+        ref = self.refs.get(id(unit))
+        return ref.rank if ref is not None and ref() is unit else None
+
+    @contextmanager
+    def transaction(self):
+        """Context manager which defers handling events to the end of the with block,
+        so the changes made within it are handled together, in a single cycle.
+        Transactions opened while updating are handled by the ongoing cycle"""
+        if self.updating:
+            yield self
+            return
+        self.updating = True
+        try:
+            yield self
+        finally:
+            self.updating = False
+        if self.auto_update:
+            self.update()
 
     def notify(self, event):
-        """Notifies Updater of new event, adds it to list of events"""
-        logger.debug('New Updater event: ' + repr(event))
+        """Notifies Updater of new event, adds it to the queue of events"""
         self.events.append(event)
+        if self.tracer is not None:
+            self.tracer.event_queued(event)
         
+    def rank(self, drives):
+        """Rank subscribers by logic level, enabling levelized evaluation.
+
+        drives maps each subscriber to the wire indexes it writes when updated. Together with
+        the subscriptions it makes up the graph of subscribers, which is ranked so that
+        every subscriber ranks higher than the ones driving its triggers.
+        Subscribers in cyclic paths (e.g. latches) are left unranked and are handled
+        in delta cycles."""
+        drives = {self.reference(unit) : wires for unit, wires in drives.items()}
+        successors = {}
+        for ref, wires in drives.items():
+            subscribers = (sub for wire in wires for sub in self.relations.get(wire, ()))
+            successors[ref] = [sub for sub in dict.fromkeys(subscribers) if sub in drives]
+        levels = dict.fromkeys(drives, 0)
+        for component in reversed(self._strongly_connected(successors)):
+            cyclic = len(component) > 1 or component[0] in successors[component[0]]
+            for ref in component:
+                ref.rank = None if cyclic else levels[ref]
+                for sub in successors[ref]:
+                    levels[sub] = max(levels[sub], levels[ref] + 1)
+
+    def settle(self, units):
+        """Update every unit in units once, ranked units in rank order, then handle
+        the events generated."""
+        self.updating = True
+        def key(unit):
+            rank = self.get_rank(unit)
+            return math.inf if rank is None else rank
+        for unit in sorted(units, key=key):
+            unit.update()
+            if self.tracer is not None:
+                self.tracer.circuit_evaluated(unit)
+        self.update()
+
+    @staticmethod
+    def _strongly_connected(successors):
+        """Iterative Tarjan's algorithm. Return the strongly connected components
+        of the graph in reverse topological order"""
+        index, low = {}, {}
+        stack, on_stack, components = [], set(), []
+        counter = itertools.count()
+        for root in successors:
+            if root in index:
+                continue
+            index[root] = low[root] = next(counter)
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(successors[root]))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in index:
+                        index[child] = low[child] = next(counter)
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(successors[child])))
+                        break
+                    elif child in on_stack:
+                        low[node] = min(low[node], index[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            unit = stack.pop()
+                            on_stack.discard(unit)
+                            component.append(unit)
+                            if unit is node:
+                                break
+                        components.append(component)
+        return components
+
     def update(self):
-        """Handle all events from this cycle until list is empty or threshold blows up.
+        """Handle all events from this cycle until no events are left or threshold blows up.
 
-        Handle all events in self.events. Events are handled in a FIFO manner
-        and handling events is likely to cause more events to be generated.
+        Ranked subscribers (see rank) are updated in rank order, each of them once per
+        cycle as long as the events come from ranked subscribers.
 
-        If the number of events in the cycle exceed threshold, raises a Runtime error
+        Events for unranked subscribers are handled in delta cycles. The events queued
+        since the previous delta make up the next delta. Every circuit
+        subscribed to a wire that changed in the delta is updated exactly once,
+        regardless of how many of its trigger wires changed. Updating circuits
+        presumably generates further events, which are handled in the following delta.
+
+        If the number of deltas in the cycle exceed threshold, raises a Runtime error
         with the last circuits handled.
         """
-        #should change to a Breadth first algorithm
-        logger.info('Handling events')
         self.updating = True
+        tracer = self.tracer
         deque_len = 50
         last = deque([None]*deque_len, maxlen=deque_len)
-        for i in range(self.threshold):
-            try:
-                event = self.events.pop(0)
-            except IndexError:
+        ranked, queued, order = [], set(), itertools.count()
+        delta = {}
+        deltas = 0
+        relations = self.relations
+        while True:
+            if self.events:
+                events, self.events = self.events, deque()
+                for event in events:
+                    for ref in relations.get(event, ()):
+                        rank = ref.rank
+                        if rank is None:
+                            delta[ref] = None
+                        elif ref not in queued:
+                            queued.add(ref)
+                            heapq.heappush(ranked, (rank, next(order), ref))
+            if ranked:
+                ref = heapq.heappop(ranked)[2]
+                queued.discard(ref)
+                circuit = ref()
+                if circuit is not None:
+                    last.append(circuit)
+                    circuit.update()
+                    if tracer is not None:
+                        tracer.circuit_evaluated(circuit)
+            elif delta:
+                deltas += 1
+                if deltas > self.threshold:
+                    self.updating = False
+                    error_str = 'Update threshold blew up; check for cyclic path.'
+                    error = RuntimeError(error_str, last)
+                    raise error
+                current, delta = delta, {}
+                for ref in current:
+                    circuit = ref()
+                    if circuit is not None:
+                        last.append(circuit)
+                        circuit.update()
+                        if tracer is not None:
+                            tracer.circuit_evaluated(circuit)
+            else:
                 self.updating = False
                 break
-            logger.debug('Handling event {}'.format(event))
-            for circuit in self.relations[id(event.obj)]:
-                last.append(circuit)
-                logger.debug('updating circuit {}'.format(circuit))
-                circuit.update()
-        else:
-            self.updating = False
-            error_str = 'Update threshold blew up; check for cyclic path.'
-            error = RuntimeError(error_str, last)
-            raise error
+
+
+class Simulation:
+    """
+    Simulation owns the state of a design: an Updater, the WireStore holding
+    its wires and the root of its circuit hierarchy.
+
+    Wires, buses and circuits belong to the Simulation that is current when
+    they are created. Simulations are made current as context managers, eg.
+
+        with Simulation() as sim:
+            adder = CPA(size=8)
+
+    Outside of any with block the current Simulation is Simulation.default.
+    Current simulations are tracked per thread, so independent designs can be
+    elaborated and simulated in different threads.
+
+    tracer is assigned to the updater, see Tracer. With four_state the store
+    simulates X and Z states, see WireStore and Signal.
+
+    parent is the circuit being made, new circuits become its children. At the
+    top of the hierarchy it is the simulation itself, children holds the
+    top level circuits.
+
+    Within elaborate, circuits are built without subscribing to the updater or
+    being evaluated: they are kept in deferred and set up once, see elaborate.
+    """
+    default = None
+    _context = threading.local()
+    def __init__(self, threshold=2**16, tracer=None, four_state=False):
+        self.updater = Updater(threshold)
+        self.updater.tracer = tracer
+        self.store = WireStore(self.updater, four_state)
+        self.children = []
+        self.parent = self
+        self.deferring = 0
+        self.deferred = {}
+
+    def __repr__(self):
+        return '{}: wires={}; circuits={}'.format(self.__class__.__name__,
+                                                 len(self.store), len(self.children))
+
+    def __enter__(self):
+        self._stack().append(self)
+        return self
+
+    def __exit__(self, *exc):
+        self._stack().pop()
+
+    @contextmanager
+    def elaborate(self):
+        """Context manager for building designs in batch, eg.
+
+            with sim.elaborate():
+                ram = RAM(8, size=8)
+
+        Circuits built or connected within the with block don't subscribe their
+        triggers nor evaluate, which would reach a half built design. When the
+        outermost elaborate block exits each deferred circuit subscribes its
+        triggers once, then circuits are initialized in the order they were made,
+        parents before children, and the design settles in a single transaction.
+        Events only reaching circuits which are yet to be initialized are dropped,
+        those circuits read the new values anyway.
+        Blocks may be nested, eg. within make. If the body raises, the circuits
+        deferred within the block are dropped, so a half built design isn't set
+        up by a later elaborate.
+        The cyclic garbage collector is paused within the outermost block: building
+        allocates many objects and frees few, collections would only rescan them"""
+        self.deferring += 1
+        count = len(self.deferred)
+        collecting = self.deferring == 1 and gc.isenabled()
+        if collecting:
+            gc.disable()
+        try:
+            with self.updater.transaction():
+                try:
+                    yield self
+                except BaseException:
+                    for key in list(self.deferred)[count:]:
+                        del self.deferred[key]
+                    raise
+                finally:
+                    self.deferring -= 1
+                if not self.deferring:
+                    circuits = list(self.deferred.values())
+                    self.deferred.clear()
+                    for circuit in circuits:
+                        circuit.update_triggers()
+                    self._initialize(circuits)
+        finally:
+            if collecting:
+                gc.enable()
+
+    def _initialize(self, circuits):
+        """Initialize circuits in order, keeping the events which reach circuits
+        other than the ones waiting to be initialized"""
+        updater = self.updater
+        relations = updater.relations
+        waiting = {id(circuit) for circuit in circuits}
+        def reaching(events):
+            return [event for event in events
+                    if any(id(ref()) not in waiting for ref in relations.get(event, ()))]
+        pending = deque(reaching(updater.events))
+        for circuit in circuits:
+            updater.events = deque()
+            circuit.initialize()
+            waiting.discard(id(circuit))
+            pending.extend(reaching(updater.events))
+        updater.events = pending
+
+    @classmethod
+    def _stack(cls):
+        try:
+            return cls._context.stack
+        except AttributeError:
+            cls._context.stack = []
+            return cls._context.stack
+
+    @classmethod
+    def current(cls):
+        """Return the innermost Simulation entered in this thread, the default one
+        if there is none"""
+        stack = getattr(cls._context, 'stack', None)
+        return stack[-1] if stack else cls.default
+
+Simulation.default = Simulation()
@@ -1,10 +1,9 @@
-from collections import namedtuple
-from pdd.core import Updater, Signal, Wire, StaticWire
-import warnings, logging
+from collections import namedtuple, Counter
+from pdd.core import Signal, Wire, WireStore, Simulation
+import copy, warnings, logging
 
 logger = logging.getLogger(__name__)
-u = Updater()
-Wire.updater = u
+u = Simulation.default.updater
        
 class Bus:
     """
@@ -25,29 +24,39 @@ class Bus:
     instead to handle that.
     Two buses are equal if their signal are equal, len(bus) return the
     number of wires.
+
+    The wires of a Bus are kept as a sequence of indexes in the WireStore of
+    the current Simulation, bus.wires returns Wire handles for them.
+    Buses returned by operations are views over the wires of their operands,
+    contiguous wires are kept as ranges.
+    New wires are 0 unless signal is given, or X in four-state simulations.
     """
-    _vdd_wire = StaticWire(1)
-    _gnd_wire = StaticWire(0)
-    def __init__(self, n=1, signal=0):
+    def __init__(self, n=1, signal=None):
         if n <= 0:
             raise ValueError('Bus size must be > 0')
-        self.wires = [Wire() for _ in range(n)]
-        self.signal = signal
-        logger.debug(repr(self))
+        self.store = Simulation.current().store
+        self.indexes = self.store.alloc(n)
+        if signal is not None:
+            self.signal = signal
 
     def __repr__(self):
         s = '{}: signal={}; len={};'
         return s.format(self.__class__, str(self.signal), len(self))
         
     def __len__(self):
-        return len(self.wires)
+        return len(self.indexes)
 
     def __getitem__(self, index):
         """Creates a new Bus from the sliced wires, returns new Bus"""
-        wires = self.wires[index]
-        if type(wires) != list:
-            wires = [wires]
-        return Bus._from_wires(wires)
+        indexes = self.indexes[index]
+        if type(indexes) is int:
+            indexes = [indexes]
+        return Bus._from_indexes(indexes, self.store)
+
+    @property
+    def wires(self):
+        """List of Wire handles for the wires in Bus"""
+        return [Wire.handle(index, self.store) for index in self.indexes]
 
     def __eq__(self, other):
         #I feel like I shouldn't do that. Buses can't be "equal"
@@ -56,17 +65,31 @@ class Bus:
     @property
     def signal(self):
         """Returns Signal object for bus"""
-        return Signal.from_wires(self.wires)
+        store = self.store
+        indexes = self.indexes
+        if store.four_state:
+            return Signal(store.pack(indexes), len(indexes), store.pack_unknown(indexes))
+        return Signal(store.pack(indexes), len(indexes))
         
     @signal.setter
     def signal(self, value):
-        """Assigns a new Signal to the bus and notifies the updater"""
+        """Assigns a new Signal to the bus and notifies the updater.
+        All wires are written before events are handled, in a single cycle"""
         new_signal = value if type(value) is Signal else Signal(value, len(self))
         if self.signal == new_signal:
             return
+        self._write(new_signal.bits)
+
+    def _write(self, bits):
+        """Drive the wires of the bus to bits within a transaction"""
+        store = self.store
+        if store.updater.updating:
+            for index, bit in zip(self.indexes, bits):
+                store.drive(index, bit)
         else:
-            for wire, bit in zip(self.wires, new_signal.bits):
-                wire.bit = bit
+            with store.updater.transaction():
+                for index, bit in zip(self.indexes, bits):
+                    store.drive(index, bit)
 
    
     def __add__(self, other):
@@ -75,20 +98,38 @@ class Bus:
         the lefthand bits get shifted to the left.
         This operation is not commutative."""
         try:
-            wires = other.wires + self.wires 
-            return self._from_wires(wires)
+            low, high = other.indexes, self.indexes
         except AttributeError:
             return NotImplemented
+        if type(low) is range and type(high) is range and low.step == high.step == 1 \
+           and low.stop == high.start:
+            indexes = range(low.start, high.stop)
+        else:
+            indexes = list(low) + list(high)
+        return self._from_indexes(indexes, self._common_store([self, other]))
+
+    @staticmethod
+    def _common_store(buses):
+        """Return the WireStore shared by buses. Buses made up only by static
+        wires go along with any store. Raise ValueError for buses of different stores"""
+        store = buses[0].store
+        if all(bus.store is store for bus in buses):
+            return store
+        stores = {id(bus.store) : bus.store for bus in buses
+                  if any(index > WireStore.VDD for index in bus.indexes)}
+        if len(stores) > 1:
+            raise ValueError('Buses belong to different simulations')
+        return stores.popitem()[1] if stores else store
 
     @classmethod
-    def merge(self, buses):
+    def merge(cls, buses):
         """Return a unified Bus from a list of buses. buses[0] will
         represent the LSB of the resulting bus"""
         buses = list(buses) #makes copy of buses
-        bus = buses.pop()
-        while buses:
-            bus = bus + buses.pop()
-        return bus
+        if len(buses) == 1:
+            return buses[0]
+        indexes = [index for bus in buses for index in bus.indexes]
+        return cls._from_indexes(indexes, cls._common_store(buses))
 
     def sweep(self):
         """Generator that sweeps over all possible signs for Bus.
@@ -112,19 +153,28 @@ class Bus:
         """Branche a Bus into a Bus of length n. Analogous to making a Bus
         out of the same wire. Always branch the 0th wire"""
         n = self._get_op_len(l)
-        wire = self.wires[0]
-        wires = [wire] * n
-        return self._from_wires(wires)
+        indexes = [self.indexes[0]] * n
+        return self._from_indexes(indexes, self.store)
+
+    def resolve(self):
+        """Turn the wires of the bus into resolved nets, see WireStore. Terminals
+        driving them become tri-state drivers of the nets. Return self"""
+        self.store.resolve(self.indexes)
+        return self
+
+    @property
+    def contention(self):
+        """True if any wire of the bus has more than one active driver"""
+        conflicts = self.store.conflicts
+        return bool(conflicts) and any(index in conflicts for index in self.indexes)
 
     def set(self):
         """Sets all wires in Bus to 1"""
-        for wire in self.wires:
-            wire.bit = 1
+        self._write([1] * len(self))
 
     def reset(self):
         """Set all wires in Bus to 0"""
-        for wire in self.wires:
-            wire.bit = 0
+        self._write([0] * len(self))
 
     def pulse(self):
         """Consecutive call to set and reset"""
@@ -133,7 +183,8 @@ class Bus:
 
     def split(self):
         """Return self as a list of 1 bit buses"""
-        buses = [self._from_wires([wire]) for wire in self.wires]
+        indexes = self.indexes
+        buses = [self._from_indexes(indexes[i:i+1], self.store) for i in range(len(indexes))]
         return buses
 
     def sign_extend(self, l):
@@ -141,8 +192,8 @@ class Bus:
         with the MSB"""
         n = self._get_op_len(l)
         diff = n - len(self)
-        wires = self.wires + [self.wires[-1]] * diff
-        return self._from_wires(wires)
+        indexes = list(self.indexes) + [self.indexes[-1]] * diff
+        return self._from_indexes(indexes, self.store)
         
     def extend(self, value, l):
         """Return an extended version of self with added padding
@@ -151,11 +202,11 @@ class Bus:
         n = self._get_op_len(l)
         diff = n - len(self)
         if value == 0:
-            padding = [self._gnd_wire] * diff
+            padding = [WireStore.GND] * diff
         if value == 1:
-            padding = [self._vdd_wire] * diff
-        wires = self.wires + padding
-        return self._from_wires(wires)
+            padding = [WireStore.VDD] * diff
+        indexes = list(self.indexes) + padding
+        return self._from_indexes(indexes, self.store)
 
     def zero_extend(self, l):
         """Zero extend self to length l"""
@@ -167,10 +218,14 @@ class Bus:
     
        
     @classmethod
-    def _from_wires(cls, wires):
-        """Initialize Bus from a sequence of wires"""
-        bus = cls(len(wires))
-        bus.wires = wires
+    def _from_indexes(cls, indexes, store):
+        """Initialize Bus from a sequence of wire indexes in store. The new Bus is a view
+        over those wires, no wires are allocated"""
+        if not len(indexes):
+            raise ValueError('Bus size must be > 0')
+        bus = object.__new__(cls)
+        bus.store = store
+        bus.indexes = indexes
         return bus
  
     @classmethod
@@ -178,16 +233,16 @@ class Bus:
         """Return VDD, a StaticWire, meaning that it is always 1. Optionally
         receive l, integer or Bus, which determines the length of the Bus."""
         n = cls._get_op_len(l)
-        wires = [cls._vdd_wire] * n
-        return cls._from_wires(wires)
+        indexes = [WireStore.VDD] * n
+        return cls._from_indexes(indexes, Simulation.current().store)
 
     @classmethod
     def gnd(cls, l=1):
         """Return GND, a StaticWire, meaning that it is always 0. Optionally
         receive l, integer or Bus, which determines the length of the Bus."""
         n = cls._get_op_len(l)
-        wires = [cls._gnd_wire] * n
-        return cls._from_wires(wires)
+        indexes = [WireStore.GND] * n
+        return cls._from_indexes(indexes, Simulation.current().store)
         
     
 class Terminal:
@@ -213,11 +268,19 @@ class Terminal:
     Size is required for Terminal init, upon init valid Buses are created
     and assigned to 'a' and 'y'. Optionally, the 'a' and 'y' Buses can be
     given at init.
+
+    A Terminal whose y has resolved wires (see Bus.resolve) is a tri-state driver
+    of them: it contributes its output while enabled and withdraws it when disabled,
+    and it only touches the nets when its enable or its output change.
     """
     vdd = Bus.vdd()
     def __init__(self, size, label, a=None, y=None, en=None, bubble=False):
         self.size = size
         self.label = label
+        self.flattened = False
+        self.resolved = False
+        self._resolutions = -1
+        self._driving = None
         self._a = None
         self._y = None
         self._en = None
@@ -233,7 +296,6 @@ class Terminal:
     def _setter(self, attr, value, size):
         """DRY for setter methods. attr is a string, value is a Bus object.
         Checks that value is of type Bus and sets the attr"""
-        logger.info(f'Setting {self} {attr} connection with {value}')
         if type(value) is not Bus:
             e = TypeError('Terminal attributes must be Buses')
             logger.exception(repr(self))
@@ -244,6 +306,8 @@ class Terminal:
             raise e
         else:
             self.__dict__['_'+attr] = value
+            if attr == 'y':
+                self._resolutions = -1
 
     def _getter(self, attr):
         """DRY for getter method"""
@@ -255,13 +319,143 @@ class Terminal:
 
     def propagate(self):
         """Transmit the signal from the in_bus to the out bus if Bus is connected"""
-        logger.debug(f'Propagate {repr(self)}')
         sig = self.a.signal
-        if self.en.signal == self.vdd.signal:
+        if self._resolutions != self.y.store.resolutions:
+            self._check_resolved()
+        if self.resolved:
+            self._drive_resolved(sig)
+        elif self.en.signal == self.vdd.signal:
             self.y.signal = sig if not self.bubble else sig.complement()
+        elif self.en.signal.unknown:
+            self.y.signal = self._unknown()
+
+    def _unknown(self):
+        """All X signal, driven when en is X or Z"""
+        mask = Signal.mask(self.size)
+        return Signal(mask, self.size, mask)
+
+    def _check_resolved(self):
+        store = self.y.store
+        self._resolutions = store.resolutions
+        self.resolved = any(index in store.drivers for index in self.y.indexes)
+
+    def _drive_resolved(self, sig):
+        """Contribute sig to the resolved wires of y if enabled, withdraw otherwise.
+        Wires of y which aren't resolved are set as usual"""
+        if self.en.signal == self.vdd.signal:
+            bits = (sig if not self.bubble else sig.complement()).bits
+        elif self.en.signal.unknown:
+            bits = self._unknown().bits
+        else:
+            bits = None
+        if bits == self._driving:
+            return
+        self._driving = bits
+        store = self.y.store
+        with store.updater.transaction():
+            for i, index in enumerate(self.y.indexes):
+                bit = None if bits is None else bits[i]
+                if index in store.drivers:
+                    store.contribute(index, self, bit)
+                elif bit is not None:
+                    store.drive(index, bit)
+
+    def withdraw(self):
+        """Withdraw from the resolved wires driven"""
+        if self._driving is None:
+            return
+        self._driving = None
+        store = self.y.store
+        for index in self.y.indexes:
+            if index in store.drivers:
+                store.contribute(index, self, None)
+
+    def update(self):
+        """Terminals are updated as buffers when subscribed to the updater on their own
+        (see BaseCircuit.levelize)"""
+        self.propagate()
 
     def get_triggers(self):
-        return self.a.wires + self.en.wires
+        """Return the indexes of the wires which trigger propagation"""
+        return list(self.a.indexes) + list(self.en.indexes)
+
+class InputTerminal:
+    """
+    Accessor for the input label of circuits. Reading it returns the outer Bus
+    of the terminal, assigning to it sets the signal of that Bus.
+    """
+    __slots__ = ('label',)
+    def __init__(self, label):
+        self.label = label
+
+    def __get__(self, circuit, owner=None):
+        if circuit is None:
+            return self
+        try:
+            return circuit.terminals[self.label].a
+        except (AttributeError, KeyError):
+            pass
+        try:
+            return circuit.__dict__[self.label]
+        except KeyError:
+            raise AttributeError(self.label) from None
+
+    def __set__(self, circuit, value):
+        try:
+            bus = circuit.terminals[self.label].a
+        except (AttributeError, KeyError):
+            circuit.__dict__[self.label] = value
+        else:
+            bus.signal = value
+
+
+class OutputTerminal:
+    """
+    Accessor for the output label of circuits, returns the outer Bus of the terminal.
+    """
+    __slots__ = ('label',)
+    def __init__(self, label):
+        self.label = label
+
+    def __get__(self, circuit, owner=None):
+        if circuit is None:
+            return self
+        try:
+            return circuit.terminals[self.label].y
+        except (AttributeError, KeyError):
+            raise AttributeError(self.label) from None
+
+
+class SharedTerminal(InputTerminal):
+    """
+    Accessor for a label which is an input of some circuits of a class and an
+    output of others (see BaseCircuit._add_instance_accessors). The output labels
+    of a circuit are looked up once, as a set kept in its _output_set.
+    """
+    __slots__ = ()
+    def _is_output(self, circuit):
+        try:
+            outputs = circuit._output_set
+        except AttributeError:
+            outputs = circuit._output_set = frozenset(circuit.output_labels)
+        return self.label in outputs
+
+    def __get__(self, circuit, owner=None):
+        if circuit is None:
+            return self
+        if self._is_output(circuit):
+            try:
+                return circuit.__dict__[self.label]
+            except KeyError:
+                return circuit.terminals[self.label].y
+        return super().__get__(circuit, owner)
+
+    def __set__(self, circuit, value):
+        if self._is_output(circuit):
+            circuit.__dict__[self.label] = value
+        else:
+            super().__set__(circuit, value)
+
 
 class BaseCircuit:
     """
@@ -271,15 +465,77 @@ class BaseCircuit:
     labels (eg 'a', 'y'): Bus that will be connected to the circuit's terminals
     
     Either a data carrying Bus or size must be part of kwargs otherwise an Exception is raised
+
+    Inputs left unconnected are X in four-state simulations, defaults maps the labels
+    of inputs which may be left unconnected to the signal they carry
+
+    Terminals are accessed as attributes named by their labels (InputTerminal and
+    OutputTerminal) generated as classes are defined. Circuits which set their labels
+    in __init__ add accessors for them to their class, once per class and labels.
+
+    model selects between the structural circuit (made of blocks by make) and its
+    behavioral model, if one is registered (see BehavioralCircuit). It may be set
+    globally in BaseCircuit, per class or given as a kwarg, eg. CPA(model='behavioral')
     """
-    updater = u
-    parent = None
-    children = []
     state_internal_flag = True
+    defaults = {}
+    model = 'structural'
+    models = ('structural', 'behavioral')
+    _accessorized = set()
+    _behavioral = {}
+
+    def __new__(cls, *args, **kwargs):
+        model = kwargs.get('model') or cls.model
+        if model not in BaseCircuit.models:
+            raise ValueError('Unknown circuit model "{}"'.format(model))
+        if model == 'behavioral':
+            cls = BaseCircuit._behavioral.get(cls, cls)
+        return object.__new__(cls)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._add_accessors(cls.__dict__.get('input_labels', ()), cls.__dict__.get('output_labels', ()))
+
+    @classmethod
+    def _add_accessors(cls, input_labels, output_labels):
+        """Add terminal accessors for labels to cls, attributes defined by cls are kept"""
+        for labels, accessor in ((input_labels, InputTerminal), (output_labels, OutputTerminal)):
+            for label in labels:
+                if label not in cls.__dict__:
+                    setattr(cls, label, accessor(label))
+
+    def _add_instance_accessors(self):
+        """Add accessors for the labels of a circuit which sets them in __init__ to its
+        class. Attributes of the class and its bases are kept, labels which are inputs
+        of some circuits of the class and outputs of others get a SharedTerminal"""
+        cls = type(self)
+        key = (cls, tuple(self.input_labels), tuple(self.output_labels))
+        if key in BaseCircuit._accessorized:
+            return
+        BaseCircuit._accessorized.add(key)
+        for labels, accessor in ((self.input_labels, InputTerminal), (self.output_labels, OutputTerminal)):
+            for label in labels:
+                if not hasattr(cls, label):
+                    setattr(cls, label, accessor(label))
+                elif type(getattr(cls, label)) in {InputTerminal, OutputTerminal} - {accessor}:
+                    setattr(cls, label, SharedTerminal(label))
+
     def __init__(self, **kwargs):
         #self.input_labels = []
         #self.output_labels = []
+        if 'input_labels' in self.__dict__ or 'output_labels' in self.__dict__:
+            self._add_instance_accessors()
+        self.sim = Simulation.current()
+        self.updater = self.sim.updater
+        tracer = self.updater.tracer
+        if tracer is not None:
+            tracer.make_started(self)
+        store = self.sim.store
+        log = store.log
+        self.allocations = store.log = []
         self.triggers = []
+        self.gated = False
+        self.disabled = False
         self.parent = None
         self.children = []
         try:
@@ -301,6 +557,8 @@ class BaseCircuit:
         d = {label : size for label in labels if label not in self.sizes}
         self.sizes.update(d)
         self.terminals = {label : Terminal(size, label) for label, size in self.sizes.items()}
+        for label, signal in self.defaults.items():
+            self.terminals[label].a.signal = signal
 
         if 'bubbles' in kwargs:
             self.set_bubbles(**{label : True for label in kwargs['bubbles']})
@@ -311,13 +569,16 @@ class BaseCircuit:
         self.connect(**kwargs)
 
         self.parent = self.get_parent()
-        logger.debug('Parent of circuit {} set to {}'.format(self, self.parent))
+        logger.debug('Parent of circuit %s set to %s', self, self.parent)
         self.parent.children.append(self)
         self.make_setup()
         self.make()
         self.make_tear_down()
+        store.log = log
 
         self.update_triggers()
+        if tracer is not None:
+            tracer.make_finished(self)
 
     def __repr__(self):
         s = '{}: '.format(self.__class__.__name__)
@@ -325,28 +586,32 @@ class BaseCircuit:
         state = self.state_internal
         return s + str(state)
 
-    @staticmethod
-    def get_parent():
-        """Return value of parent set in BaseCircuit class"""
-        return BaseCircuit.parent
+    @classmethod
+    def prototype(cls, *args, **kwargs):
+        """Elaborate cls(*args, **kwargs) once, return it as a Prototype to
+        stamp copies of the circuit from"""
+        return Prototype(cls, *args, **kwargs)
 
-    @staticmethod
-    def set_parent(value):
-        """Set BaseCircuit parent attribute to value"""
-        BaseCircuit.parent = value
+    def get_parent(self):
+        """Return the circuit being made in the simulation of self"""
+        return self.sim.parent
+
+    def set_parent(self, value):
+        """Set the circuit being made in the simulation of self to value"""
+        self.sim.parent = value
 
     def make_setup(self):
         """Setup for make. Sets self as the parent in BaseCircuit"""
-        logger.debug('Make setup for circ. {}'.format(self))
+        logger.debug('Make setup for circ. %s', self)
         self.set_parent(self)
 
     def make_tear_down(self):
         """Set BaseCircuit parent attribute to self"""
-        logger.debug('Make teardown for circ. {}'.format(self))
+        logger.debug('Make teardown for circ. %s', self)
         self.set_parent(self.parent)
         
     def connect(self, **kwargs):
-        logger.debug(f'connecting {self}')
+        logger.debug('connecting %s', self)
         for label, bus in kwargs.items():
             if label in self.input_labels:
                 self.terminals[label].a = bus
@@ -356,6 +621,13 @@ class BaseCircuit:
             pass
             #kwargs not empty, imaginary labels
         self.update_triggers()
+        if not self.sim.deferring:
+            self.update()
+
+    def initialize(self):
+        """Evaluate a circuit deferred by Simulation.elaborate as building it would
+        have: leaf circuits are updated, composite circuits propagate their inputs
+        and outputs, so bubbles and the buses connected to outputs are set"""
         self.update()
 
     def connect_sequence(self, seq):
@@ -369,12 +641,181 @@ class BaseCircuit:
         self.connect(**connections)
 
     def update_triggers(self):
-        """Update the trigger Buses in the observer object"""
-        self.updater.unsubscribe(self, self.triggers)
-        nested_wires = [terminal.get_triggers() for terminal in self.terminals.values()]
-        self.triggers = [wire for wires in nested_wires for wire in wires]
-        self.updater.subscribe(self, self.triggers)
+        """Update the trigger Buses in the observer object. Within Simulation.elaborate
+        the circuit is deferred instead.
+        Leaf circuits whose outputs are all tri-stated are gated: while every output
+        is disabled they are only subscribed to the enables, see _gate"""
+        sim = self.sim
+        if sim.deferring:
+            sim.deferred[id(self)] = self
+            return
+        composite = type(self).update is BaseCircuit.update
+        outputs = [self.terminals[label] for label in self.output_labels]
+        self.gated = not composite and bool(outputs) and all(
+            list(terminal.en.indexes) != [WireStore.VDD] for terminal in outputs)
+        if self.gated and self.disabled:
+            nested_wires = [terminal.en.indexes for terminal in outputs]
+        else:
+            nested_wires = [terminal.get_triggers() for terminal in self.terminals.values()
+                            if not (composite and terminal.flattened)]
+        triggers = [wire for wires in nested_wires for wire in wires]
+        old, new = set(self.triggers), set(triggers)
+        self.updater.unsubscribe(self, old - new)
+        self.updater.subscribe(self, [wire for wire in triggers if wire not in old])
+        self.triggers = triggers
+
+    def _gate(self):
+        """Called first by update of gated circuits (see update_triggers). Return True
+        while every output is disabled, outputs are then withdrawn and the circuit
+        isn't evaluated; inputs are read once an output is enabled again"""
+        disabled = True
+        for label in self.output_labels:
+            enable = self.terminals[label].en.signal
+            if enable.value or enable.unknown:
+                disabled = False
+                break
+        if disabled != self.disabled:
+            self.disabled = disabled
+            self.update_triggers()
+        if disabled:
+            for label in self.output_labels:
+                self.terminals[label].propagate()
+        return disabled
+
+    def discard(self):
+        """Remove circuit from the hierarchy, neither it nor the circuits below it
+        will be updated any longer.
+        Its terminals withdraw from the resolved nets they drive. The wires
+        allocated while building the hierarchy, listed as ranges in the
+        allocations of its circuits, are released to the store for reuse, except
+        the ones still read by circuits outside of it. Buses of the hierarchy
+        shouldn't be used afterwards"""
+        updater = self.updater
+        if updater.collected:
+            updater.purge()
+        circuits = list(self.walk())
+        with updater.transaction():
+            for circuit in circuits:
+                updater.forget(circuit)
+                circuit.triggers = []
+                for terminal in circuit.terminals.values():
+                    updater.forget(terminal)
+                    terminal.withdraw()
+                self.sim.deferred.pop(id(circuit), None)
+        self.parent.children.remove(self)
+        relations = updater.relations
+        unused = [index for circuit in circuits for indexes in circuit.allocations
+                  for index in indexes if index not in relations]
+        for circuit in circuits:
+            circuit.allocations = []
+        self.sim.store.release(unused)
         
+    def get_drives(self):
+        """Return the indexes of the outer wires written by update, ie. the outer side
+        of output terminals. Wires inside the circuit are left out."""
+        return [index for label in self.output_labels for index in self.terminals[label].y.indexes]
+
+    def walk(self):
+        """Generator over self and every circuit below it in the hierarchy.
+        Parents are yielded before their children"""
+        stack = [self]
+        while stack:
+            circuit = stack.pop()
+            yield circuit
+            stack.extend(reversed(circuit.children))
+
+    def levelize(self):
+        """Switch the hierarchy to levelized evaluation.
+
+        Composite circuits (ie. circuits which don't override update) are replaced
+        in the updater by their terminals, each terminal being a buffer. Every leaf
+        circuit and terminal is then ranked by logic level, so that an input change
+        updates each of them once, in rank order. Parts with cyclic paths (e.g. SRLatch)
+        remain in the event driven engine. Terminals are propagated once afterwards,
+        as the composite circuits they replace would on their next update.
+        levelize should be called again if the hierarchy is rewired."""
+        drives = {}
+        terminals = []
+        for circuit in self.walk():
+            if type(circuit).update is BaseCircuit.update:
+                self.updater.unsubscribe(circuit, circuit.triggers)
+                for terminal in circuit.terminals.values():
+                    if terminal.flattened:
+                        continue
+                    triggers = terminal.get_triggers()
+                    self.updater.unsubscribe(terminal, triggers)
+                    self.updater.subscribe(terminal, triggers)
+                    drives[terminal] = list(terminal.y.indexes)
+                    terminals.append(terminal)
+            else:
+                drives[circuit] = circuit.get_drives()
+        self.updater.rank(drives)
+        self.updater.settle(terminals)
+
+    def flatten(self):
+        """Merge the pass-through terminals below self into shared nets, the terminals
+        of self are kept. Call once the hierarchy is elaborated, it shouldn't be
+        rewired afterwards. Return the number of terminals merged"""
+        circuits = list(self.walk())
+        terminals = [t for circuit in circuits for t in circuit.terminals.values()]
+        drivers = Counter(index for t in terminals for index in t.y.indexes)
+        for circuit in circuits:
+            if type(circuit).update is not BaseCircuit.update:
+                drivers.update(index for label in circuit.output_labels
+                               for index in circuit.terminals[label].a.indexes)
+        #terminals with no bubble, always enabled and the only driver of the wires on
+        #their y side are merged: the wires on both of their sides are joined into
+        #a net (union-find over wire indexes), so signals aren't copied at every
+        #hierarchy boundary. Merged terminals are marked flattened and no longer
+        #trigger updates of the composite circuits they belong to
+        parents = {}
+        def find(index):
+            root = index
+            while parents.get(root, root) != root:
+                root = parents[root]
+            while index != root:
+                parents[index], index = root, parents[index]
+            return root
+        resolved = self.sim.store.drivers
+        merged = 0
+        for circuit in circuits[1:]:
+            for terminal in circuit.terminals.values():
+                if terminal.flattened or terminal.bubble:
+                    continue
+                if list(terminal.en.indexes) != [WireStore.VDD]:
+                    continue
+                if any(index <= WireStore.VDD or drivers[index] != 1 or index in resolved
+                       for index in terminal.y.indexes):
+                    continue
+                for a, y in zip(terminal.a.indexes, terminal.y.indexes):
+                    root_a, root_y = find(a), find(y)
+                    if root_a != root_y:
+                        parents[root_y] = root_a
+                terminal.flattened = True
+                merged += 1
+        #buses of the hierarchy are remapped to the merged nets, which carry the value
+        #of their driving side; readers of wires changed that way are updated. Buses
+        #with a driver shouldn't be assigned afterwards, the assignment would reach
+        #every circuit on the net
+        bits = self.sim.store.bits
+        changed = {find(index) for index in parents if bits[index] != bits[find(index)]}
+        buses = {id(bus) : bus for t in terminals for bus in (t.a, t.y, t.en)}
+        for bus in buses.values():
+            indexes = [find(index) for index in bus.indexes]
+            if indexes != list(bus.indexes):
+                bus.indexes = indexes
+        for circuit in circuits:
+            circuit.update_triggers()
+        with self.updater.transaction():
+            for index in changed:
+                self.updater.notify(index)
+        return merged
+
+    def compile(self, threshold=2**20):
+        """Return the hierarchy compiled into flat gate arrays, see pdd.compiler"""
+        from pdd.compiler import CompiledCircuit
+        return CompiledCircuit(self, threshold)
+
     def make(self):
         """Make must be implemented by subclasses. The body of make contain the
         the creation of circuit blocks used by the class, the association between
@@ -393,12 +834,31 @@ class BaseCircuit:
     def set_outputs(self, **kwargs):
         """Used to set the outputs of a circuit in make(). 
         kwargs keys are labels and kwargs values are buses.
-        eg self.terminals['y'].a = kwargs['y']"""
+        eg self.terminals['y'].a = kwargs['y']
+        In four-state simulations outputs are propagated, so they carry the signals
+        set up in make instead of X. Two-state outputs keep their power-up 0"""
         #add logic to handle case where bus doesn't exist
         for label, bus in kwargs.items():
             if label in self.output_labels:
                 self.terminals[label].a = bus 
         self.update_triggers()
+        if not self.sim.store.four_state or self.sim.deferring:
+            return
+        for label in kwargs:
+            if label in self.output_labels:
+                self.terminals[label].propagate()
+
+    def settle_outputs(self):
+        """Propagate the outputs of the composite circuits of the hierarchy, the
+        innermost first, unless deferred by Simulation.elaborate. Combinational
+        blocks may call it at the end of make, so their two-state outputs carry
+        the function of the inputs from the start instead of their power-up 0"""
+        if self.sim.deferring:
+            return
+        for circuit in reversed(list(self.walk())):
+            if type(circuit).update is BaseCircuit.update:
+                for label in circuit.output_labels:
+                    circuit.terminals[label].propagate()
 
     def get_bubbles(self):
         return {label : self.terminals[label].bubble for label in self.input_labels + self.output_labels}
@@ -416,32 +876,31 @@ class BaseCircuit:
         update should - under normal circumstances be called by the Updater
         object automatically"""
         for terminal in self.terminals.values():
-            terminal.propagate()
+            if not terminal.flattened:
+                terminal.propagate()
 
+    _namedtuples = {}
     @staticmethod
     def namedtuple_factory(name, dict):
-        """Factory method for namedtuples. Create a nametuple factory and
-        return an instance of the factory initialized to the values in dict"""
-        factory = namedtuple(name, list(dict.keys()))
+        """Factory method for namedtuples. Return an instance of the namedtuple
+        class for name and the keys of dict, initialized to the values in dict.
+        Classes are created once per name and keys"""
+        key = (name,) + tuple(dict)
+        try:
+            factory = BaseCircuit._namedtuples[key]
+        except KeyError:
+            factory = BaseCircuit._namedtuples[key] = namedtuple(name, list(dict.keys()))
         return factory(**dict)
 
-    def __setattr__(self, attr, value):
-        if attr == 'input_labels':
-            object.__setattr__(self, attr, value)
-        elif attr in self.input_labels:
-            self.terminals[attr].a.signal = value
-        else:
-            object.__setattr__(self, attr, value)
-        
-    def __getattr__(self, attr):
-        if attr == 'input_labels' or attr == 'output_labels':
-            object.__getattribute__(self, attr)
-        elif attr in self.input_labels:
-            return self.terminals[attr].a
-        elif attr in self.output_labels:
-            return self.terminals[attr].y
-        else:
-            object.__getattribute__(self, attr)
+    def apply(self, **signals):
+        """Assign signals to input terminals by label, eg. circuit.apply(a=1, b=2).
+        Every input is written before events are handled, so the circuit settles
+        once on the new inputs"""
+        with self.updater.transaction():
+            for label, value in signals.items():
+                if label not in self.input_labels:
+                    raise ValueError('Label "{}" is not an input of circuit'.format(label))
+                self.terminals[label].a.signal = value
 
     def get_bus(self, label):
         """Return the Bus matching label"""
@@ -458,8 +917,12 @@ class BaseCircuit:
         return [self.get_bus(label) for label in buses]
 
     def set_tristate(self, **kwargs):
+        """Set the enable Bus of terminals by label. The circuit is subscribed
+        to the enables, so it's updated as they change, and gated if every output
+        is tri-stated (see update_triggers)"""
         for label, bus in kwargs.items():
             self.terminals[label].en = bus
+        self.update_triggers()
 
     @property
     def state(self):
@@ -484,13 +947,240 @@ class BaseCircuit:
 
     @property
     def auto_update(self):
-        return Wire.auto_update
+        return self.updater.auto_update
 
     @auto_update.setter
     def auto_update(self, value):
         if not type(value) is bool:
             raise ValueError('Value must be bool')
-        Wire.auto_update = value
+        self.updater.auto_update = value
+
+
+class BehavioralCircuit(BaseCircuit):
+    """
+    Circuit described by a Python function over its signals instead of blocks, eg.
+
+        class BehavioralCPA(BehavioralCircuit, CPA):
+            def function(self, a, b, cin):
+                s = int(a) + int(b) + int(cin)
+                return dict(s=s, cout=s >> self.sizes['a'])
+
+    function takes the input signals as kwargs by label and returns a dict of output
+    signals (or ints, truncated to the size of the output) by label. Behavioral circuits
+    are leaves: they subscribe to their inputs and evaluate function on every update.
+    Outputs are X while any input is X or Z.
+
+    A behavioral circuit derived from a structural one, as BehavioralCPA above, is
+    registered as its behavioral model and is built in its place when the model is
+    'behavioral' (see BaseCircuit). tools.equivalent compares both models.
+    One-off circuits pass function, labels and sizes as kwargs, eg.
+    BehavioralCircuit(function=f, input_labels=['a'], output_labels=['y'], size=4)
+    """
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for base in cls.__bases__:
+            if issubclass(base, BaseCircuit) and not issubclass(base, BehavioralCircuit):
+                BaseCircuit._behavioral[base] = cls
+                break
+
+    def __init__(self, *args, function=None, input_labels=None, output_labels=None, sizes=None, **kwargs):
+        if function is not None:
+            self.function = function
+        if input_labels is not None:
+            self.input_labels = list(input_labels)
+        if output_labels is not None:
+            self.output_labels = list(output_labels)
+        if sizes is not None:
+            self.sizes = sizes
+        super().__init__(*args, **kwargs)
+
+    def function(self, **signals):
+        """function must be implemented by subclasses, or given as a kwarg. Return
+        the output signals for the input signals, by label. Outputs left out keep
+        their signal"""
+        pass
+
+    def make(self):
+        pass
+
+    def update(self):
+        if self.gated and self._gate():
+            return
+        terminals = self.terminals
+        signals = {}
+        for label in self.input_labels:
+            terminal = terminals[label]
+            terminal.propagate()
+            signals[label] = terminal.y.signal
+        if any(signal.unknown for signal in signals.values()):
+            outputs = {label : terminals[label]._unknown() for label in self.output_labels}
+        else:
+            outputs = self.function(**signals) or {}
+        for label in self.output_labels:
+            terminal = terminals[label]
+            if label in outputs:
+                value = outputs[label]
+                if type(value) is not Signal:
+                    value = Signal(value & Signal.mask(terminal.size), terminal.size)
+                terminal.a.signal = value
+            terminal.propagate()
+
+
+class Prototype:
+    """
+    Elaborated circuit which serves as a template, eg.
+
+        cells = FlipFlop.prototype(size=8).instantiate(256, clk=clk, d=d, e=buses)
+
+    The circuit is made once, in a Simulation of its own. Copies of it are stamped
+    into the current Simulation by copying the hierarchy and remapping its wires
+    to newly allocated ones, which carry the settled state of the prototype,
+    rather than by running make again.
+    Buses given to the prototype must be static (eg. Bus.gnd), circuits are
+    connected as they are instantiated.
+    """
+    def __init__(self, cls, *args, **kwargs):
+        for value in kwargs.values():
+            if isinstance(value, Bus) and any(index > WireStore.VDD for index in value.indexes):
+                raise ValueError('Buses given to a prototype must be static')
+        self.sim = Simulation(four_state=Simulation.current().store.four_state)
+        with self.sim:
+            self.circuit = cls(*args, **kwargs)
 
-BaseCircuit.parent = BaseCircuit
+    def __repr__(self):
+        return 'Prototype of {}'.format(self.circuit)
+
+    def clone(self):
+        """Return an unconnected copy of the circuit in the current Simulation"""
+        sim = Simulation.current()
+        source, store = self.sim.store, sim.store
+        log, store.log = store.log, None
+        block = store.alloc(len(source) - 2)
+        store.log = log
+        offset = block.start - 2
+        store.bits[block.start:block.stop] = source.bits[2:]
+        memo = {id(self.sim) : sim, id(source) : store, id(self.sim.updater) : sim.updater}
+        circuit = self._copy(self.circuit, memo, store, offset)
+        for index, drivers in source.drivers.items():
+            store.drivers[index + offset] = {id(memo[key]) : bit for key, bit in drivers.items()}
+        store.conflicts.update(index + offset for index in source.conflicts)
+        if source.drivers:
+            store.resolutions += 1
+        circuit.parent = sim.parent
+        circuit.parent.children.append(circuit)
+        #parts keep the triggers and the settled state of the prototype, so they
+        #are subscribed even within Simulation.elaborate and aren't initialized
+        for part in circuit.walk():
+            sim.updater.subscribe(part, part.triggers)
+        circuit.allocations = [block]
+        return circuit
+
+    _atomic = {int, str, bool, float, type(None), Signal, type}
+    _circuit_fields = {'sim', 'updater', 'parent', 'terminals', 'children', 'sizes',
+                       'triggers', 'allocations'}
+
+    def _copy(self, obj, memo, store, offset):
+        """Deep copy of obj for clone. Buses are remapped to the wires at offset in store,
+        objects in memo (the simulation of the prototype) are replaced"""
+        cls = type(obj)
+        if cls in self._atomic:
+            return obj
+        try:
+            return memo[id(obj)]
+        except KeyError:
+            pass
+        if cls is Bus:
+            return self._copy_bus(obj, memo, store, offset)
+        elif isinstance(obj, BaseCircuit):
+            return self._copy_circuit(obj, memo, store, offset)
+        elif isinstance(obj, Terminal):
+            return self._copy_terminal(obj, memo, store, offset)
+        elif cls is list:
+            new = []
+            memo[id(obj)] = new
+            new.extend(self._copy(item, memo, store, offset) for item in obj)
+        elif cls is dict:
+            new = {}
+            memo[id(obj)] = new
+            for key, value in obj.items():
+                new[self._copy(key, memo, store, offset)] = self._copy(value, memo, store, offset)
+        elif cls is tuple:
+            new = tuple(self._copy(item, memo, store, offset) for item in obj)
+            memo[id(obj)] = new
+        elif hasattr(obj, '__dict__') and not callable(obj):
+            new = object.__new__(cls)
+            memo[id(obj)] = new
+            new.__dict__.update({key : self._copy(value, memo, store, offset)
+                                 for key, value in obj.__dict__.items()})
+        else:
+            new = copy.deepcopy(obj, memo)
+        return new
+
+    def _copy_bus(self, bus, memo, store, offset):
+        """Copy of bus over the wires at offset in store"""
+        try:
+            return memo[id(bus)]
+        except KeyError:
+            pass
+        new = object.__new__(Bus)
+        memo[id(bus)] = new
+        new.__dict__.update(bus.__dict__)
+        new.store = store
+        new.indexes = self._remap(bus.indexes, offset)
+        return new
+
+    def _copy_terminal(self, terminal, memo, store, offset):
+        """Copy of terminal, the rest of its fields are immutable"""
+        new = object.__new__(type(terminal))
+        memo[id(terminal)] = new
+        fields = dict(terminal.__dict__)
+        fields['_a'] = self._copy_bus(terminal._a, memo, store, offset)
+        fields['_y'] = self._copy_bus(terminal._y, memo, store, offset)
+        fields['_en'] = self._copy_bus(terminal._en, memo, store, offset)
+        fields['_resolutions'] = -1
+        new.__dict__ = fields
+        return new
+
+    def _copy_circuit(self, circuit, memo, store, offset):
+        """Copy of circuit, its terminals and the circuits below it. Attributes other
+        than the ones every circuit has go through _copy"""
+        new = object.__new__(type(circuit))
+        memo[id(circuit)] = new
+        fields = dict(circuit.__dict__)
+        fields['sim'] = memo[id(circuit.sim)]
+        fields['updater'] = memo[id(circuit.updater)]
+        fields['parent'] = memo.get(id(circuit.parent))
+        fields['sizes'] = dict(circuit.sizes)
+        fields['triggers'] = list(self._remap(circuit.triggers, offset))
+        fields['allocations'] = []
+        fields['terminals'] = {label : self._copy_terminal(terminal, memo, store, offset)
+                               for label, terminal in circuit.terminals.items()}
+        fields['children'] = [self._copy(child, memo, store, offset) for child in circuit.children]
+        for key, value in fields.items():
+            if key not in self._circuit_fields and type(value) not in self._atomic:
+                fields[key] = self._copy(value, memo, store, offset)
+        new.__dict__ = fields
+        return new
 
+    @staticmethod
+    def _remap(indexes, offset):
+        if type(indexes) is range:
+            return range(indexes.start + offset, indexes.stop + offset, indexes.step)
+        return [index + offset if index > WireStore.VDD else index for index in indexes]
+
+    def instantiate(self, n=1, tristate=None, **connections):
+        """Return a list of n copies of the circuit, see clone. Copies are connected
+        to the buses in connections by label, tristate sets their enables first.
+        Values may be a Bus, shared by every copy, or a sequence of buses, one per copy"""
+        circuits = []
+        for k in range(n):
+            circuit = self.clone()
+            if tristate:
+                circuit.set_tristate(**self._pick(tristate, k))
+            circuit.connect(**self._pick(connections, k))
+            circuits.append(circuit)
+        return circuits
+
+    @staticmethod
+    def _pick(buses, k):
+        return {label : bus if isinstance(bus, Bus) else bus[k] for label, bus in buses.items()}
@@ -0,0 +1,148 @@
+"""
+Elaboration profiler.
+
+Reports, per circuit class, what building a design costs: instances, wires,
+terminals, subscriptions in Updater.relations, time spent building and
+approximate bytes allocated (tracemalloc), eg.
+
+    report = profile(Processor)
+    print(report)
+
+or from the command line
+
+    python -m pdd.profiler pdd.sequential_blocks:RAM 8 size=8
+
+Time, bytes and wires are measured from the start of BaseCircuit.__init__ to the
+end of it (see Tracer.make_started) and are exclusive: what circuits made by
+a block cost is accounted to their own class. Circuits stamped from a
+Prototype aren't made, their cost is accounted to the block which stamped them.
+"""
+import argparse, ast, importlib, os, sys, time, tracemalloc
+from collections import namedtuple
+from pdd.core import Tracer, Simulation
+
+
+class ElaborationProfiler(Tracer):
+    """
+    Tracer which measures the cost of building every circuit.
+    costs maps circuits to their inclusive Cost, ie. including the circuits made
+    by them. Bytes are only measured while tracemalloc is tracing.
+    """
+    Cost = namedtuple('Cost', 'time bytes wires')
+    def __init__(self):
+        self.costs = {}
+        self.stack = []
+
+    def _now(self, circuit):
+        memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        return self.Cost(time.perf_counter(), memory, circuit.sim.store.allocated)
+
+    def make_started(self, circuit):
+        self.stack.append(self._now(circuit))
+
+    def make_finished(self, circuit):
+        start = self.stack.pop()
+        end = self._now(circuit)
+        self.costs[circuit] = self.Cost(*(b - a for a, b in zip(start, end)))
+
+    def report(self, root):
+        """Return the Report for root and the hierarchy below it"""
+        return Report(root, self.costs)
+
+
+class Report:
+    """
+    Elaboration cost of a hierarchy by circuit class. rows maps class names to Rows,
+    time, bytes and wires are exclusive (see module docstring).
+    """
+    Row = namedtuple('Row', 'instances wires terminals subscriptions time bytes')
+    columns = Row._fields
+
+    def __init__(self, root, costs):
+        self.root = root
+        refs = root.updater.refs
+        zero = ElaborationProfiler.Cost(0, 0, 0)
+        totals = {}
+        for circuit in root.walk():
+            cost = costs.get(circuit, zero)
+            for child in circuit.children:
+                child_cost = costs.get(child, zero)
+                cost = ElaborationProfiler.Cost(*(a - b for a, b in zip(cost, child_cost)))
+            ref = refs.get(id(circuit))
+            row = self.Row(1, cost.wires, len(circuit.terminals), len(ref.wires) if ref else 0,
+                           cost.time, cost.bytes)
+            name = type(circuit).__name__
+            total = totals.get(name)
+            totals[name] = row if total is None else self.Row(*(a + b for a, b in zip(total, row)))
+        self.rows = totals
+
+    def sorted(self, key='time'):
+        """Return (name, Row) pairs, the costliest by key first"""
+        index = self.columns.index(key)
+        return sorted(self.rows.items(), key=lambda item: item[1][index], reverse=True)
+
+    def format(self, key='time', top=None):
+        """Return the report as a table sorted by key"""
+        lines = ['{:<24} {:>9} {:>9} {:>9} {:>13} {:>9} {:>11}'.format('class', *self.columns)]
+        for name, row in self.sorted(key)[:top]:
+            lines.append('{:<24} {:>9} {:>9} {:>9} {:>13} {:>9.3f} {:>11}'.format(name, *row))
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.format()
+
+
+def profile(factory, *args, memory=True, **kwargs):
+    """Build factory(*args, **kwargs) in a Simulation of its own while profiling,
+    return its Report. The circuit is the root of the report.
+    memory traces allocations with tracemalloc, which slows building down"""
+    profiler = ElaborationProfiler()
+    tracing = memory and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    try:
+        with Simulation(tracer=profiler):
+            circuit = factory(*args, **kwargs)
+    finally:
+        if tracing:
+            tracemalloc.stop()
+    circuit.updater.tracer = None
+    return profiler.report(circuit)
+
+
+def _load(path):
+    """Return the object at path, given as module:name"""
+    module, _, name = path.partition(':')
+    sys.path.insert(0, os.getcwd())
+    return getattr(importlib.import_module(module), name)
+
+
+def _value(text):
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m pdd.profiler',
+                                     description='Report the elaboration cost of a circuit by class')
+    parser.add_argument('circuit', help='circuit class or factory, as module:name')
+    parser.add_argument('arguments', nargs='*', help='arguments to the circuit, key=value for kwargs')
+    parser.add_argument('--sort', default='time', choices=Report.columns)
+    parser.add_argument('--top', type=int, default=None, help='show only the top classes')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace allocations')
+    options = parser.parse_args(argv)
+    args, kwargs = [], {}
+    for argument in options.arguments:
+        key, sep, value = argument.partition('=')
+        if sep:
+            kwargs[key] = _value(value)
+        else:
+            args.append(_value(argument))
+    report = profile(_load(options.circuit), *args, memory=not options.no_memory, **kwargs)
+    print(report.format(options.sort, options.top))
+
+
+if __name__ == '__main__':
+    main()
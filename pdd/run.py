@@ -3,15 +3,15 @@
 
 from blocks import *
 from dl import Bus
-from core import Wire
+from core import Wire, Simulation
 from tools import *
 import logging
 import sap
 
 logging.basicConfig(filename=__file__+'.log', filemode='w', level=logging.DEBUG)
 
-u = Wire.updater
-Wire.auto_update = True
+u = Simulation.current().updater
+u.auto_update = True
 
 cu = sap.ControlUnit(size=4)
 
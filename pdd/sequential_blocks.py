@@ -67,6 +67,7 @@ class FlipFlop(BaseCircuit):
     input_labels = "r e clk l d".split()
     output_labels = "q".split()
     sizes = dict(r=1, e=1, clk=1, l=1)
+    defaults = dict(r=0, e=0, l=0)
 
     def make(self):
         i = self.get_inputs()
@@ -80,7 +81,7 @@ class FlipFlop(BaseCircuit):
         self.set_outputs(q=dflip.q)
 
         
-class Counter(BaseCircuit):
+class Counter(cb.AdderMixin, BaseCircuit):
     """
     Counter with a synchronous reset.
     c is a count signal, if c is high counter will increment on the rising edge
@@ -95,7 +96,7 @@ class Counter(BaseCircuit):
         word_size = len(i.q)
         flip = FlipFlop(q=i.q, clk=i.clk)
         c_gate = AND(a=Bus.vdd(), b=i.c)
-        adder = cb.CPA(a=flip.q, b=c_gate.y.zero_extend(flip.q))
+        adder = self.adder(a=flip.q, b=c_gate.y.zero_extend(flip.q))
         reset_mux = cb.BaseMux(d0=adder.s, d1=Bus.gnd(adder.s), s=i.r)
         flip.connect(d=reset_mux.y)
         self.set_outputs(q=flip.q)
@@ -126,6 +127,7 @@ class RAM(BaseCircuit):
     """
     input_labels = "d clk addr w ce".split()
     output_labels = "q".split()
+    decoder = cb.PredecodedDecoder
     def __init__(self, word_size, **kwargs):
         self.word_size = word_size
         self.sizes = dict(ce=1, clk=1, w=1, q=word_size, d=word_size)
@@ -133,10 +135,13 @@ class RAM(BaseCircuit):
 
     def make(self):
         i = self.get_inputs()
+        i.q.resolve()
         self.set_tristate(q=i.ce)
         #cells have active low enable
-        addr_lines = cb.Decoder(a=i.addr, e=Bus.vdd())
-        cells = [FlipFlop(clk=i.clk, d=i.d, e=en_bus, q=i.q, bubbles=['e']) for en_bus in addr_lines.y]
-        write_gates = [AND(a=i.w, b=bus, bubbles=['y']) for bus in addr_lines.y]
-        for gate, cell in zip(write_gates, cells):
-            cell.connect(l=gate.y)
+        addr_lines = self.decoder(a=i.addr, e=Bus.vdd())
+        lines = addr_lines.y.split()
+        write_gates = cb.Gate.prototype(cb.Gate.AND, size=1, bubbles=['y']).instantiate(
+            len(lines), a=i.w, b=lines)
+        cell = FlipFlop.prototype(size=self.word_size, bubbles=['e'])
+        cell.instantiate(len(lines), clk=i.clk, d=i.d, e=lines, q=i.q,
+                         l=[gate.y for gate in write_gates])
@@ -1,5 +1,9 @@
-from pdd.dl import Bus
-import unittest, re
+from pdd.dl import Bus, BaseCircuit, BehavioralCircuit
+from pdd.core import Tracer, Simulation
+from collections import Counter, namedtuple
+import unittest, re, logging, random, time
+
+logger = logging.getLogger(__name__)
 
 class TruthTable:
     """
@@ -51,8 +55,11 @@ class SignalGen:
         #tuple of slices that will enable isolating the signal value for a bus at each time
         #tuple consists of a right bitshift value and a mask to isolate the value of the signal
         #for that particular bus
-        bus_slices = [(0, 2**len(listed_buses[0])-1)]
-        bus_slices += [(len(Bus.merge(listed_buses[:i+1])), 2**len(bus)-1) for i, bus in enumerate(listed_buses[1:])]
+        bus_slices = []
+        shift = 0
+        for bus in listed_buses:
+            bus_slices.append((shift, 2**len(bus)-1))
+            shift += len(bus)
 
         values = range(2**len(super_bus))
         signals = [] 
@@ -76,8 +83,7 @@ class SignalGen:
         """Upon call returns generator object. Iteration sequentially assign
         signals in list of signals. Yield the dictionary of signals assigned"""
         for dic in self.signals:
-            for label, signal in dic.items():
-                self.buses[label].signal = signal
+            self._assign(dic)
             yield dic
            
         
@@ -88,9 +94,17 @@ class SignalGen:
         if not self.next_q:
             self.next_q = self.signals
         dic = self.next_q.pop(0)
-        for label, signal in dic.items():
-            self.buses[label].signal = signal
+        self._assign(dic)
         return dic
+
+    def _assign(self, dic):
+        """Assign the signals in dic to their buses, within a single transaction"""
+        if not dic:
+            return
+        updater = self.buses[next(iter(dic))].store.updater
+        with updater.transaction():
+            for label, signal in dic.items():
+                self.buses[label].signal = signal
              
 
     def all(self):
@@ -147,14 +161,86 @@ class IOHelper:
         text = cls._get_text(p)
         return [cls._caster(line) for line in text.split('\n') if line]
 
+Mismatch = namedtuple('Mismatch', 'inputs structural behavioral')
+
+def equivalent(factory, *args, samples=None, seed=None, **kwargs):
+    """Compare the structural and behavioral models of factory(*args, **kwargs), each
+    built in a Simulation of its own, by applying the same inputs to both.
+    Every input value is applied, in order, if samples is None, otherwise samples
+    random ones (seeded by seed). Return a list of Mismatch for the inputs on which
+    the outputs differ, empty if the models are equivalent"""
+    circuits = []
+    for model in BaseCircuit.models:
+        with Simulation():
+            circuits.append(factory(*args, model=model, **kwargs))
+    structural, behavioral = circuits
+    if not isinstance(behavioral, BehavioralCircuit):
+        raise ValueError('{} has no behavioral model'.format(type(structural).__name__))
+    sizes = [(label, structural.sizes[label]) for label in structural.input_labels]
+    n = sum(size for _, size in sizes)
+    if samples is None:
+        values = range(2 ** n)
+    else:
+        rng = random.Random(seed)
+        values = (rng.getrandbits(n) for _ in range(samples))
+    mismatches = []
+    for value in values:
+        inputs = {}
+        for label, size in sizes:
+            inputs[label] = value & (2 ** size - 1)
+            value >>= size
+        outputs = []
+        for circuit in circuits:
+            circuit.apply(**inputs)
+            outputs.append({label : circuit.get_bus(label).signal for label in circuit.output_labels})
+        if outputs[0] != outputs[1]:
+            mismatches.append(Mismatch(inputs, *outputs))
+    return mismatches
+
+def gate_bits(circuit):
+    """Return the gate count of the hierarchy of circuit, in gate bits"""
+    from pdd.combinational_blocks import Gate
+    return sum(len(gate.y) for gate in circuit.walk() if isinstance(gate, Gate))
+
+Measure = namedtuple('Measure', 'circuit build gates events evaluations us')
+
+def benchmark(factory, vectors):
+    """Build factory() in a Simulation of its own and apply vectors, dicts of input
+    signals by label, to it twice: timed, then traced. Return a Measure of the
+    circuit, its build time in seconds, its gate bits and the events (wire changes),
+    circuit evaluations and microseconds per vector"""
+    with Simulation():
+        start = time.perf_counter()
+        circuit = factory()
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        for vector in vectors:
+            circuit.apply(**vector)
+        elapsed = time.perf_counter() - start
+        tracer = RecordingTracer()
+        circuit.updater.tracer = tracer
+        for vector in vectors:
+            circuit.apply(**vector)
+        circuit.updater.tracer = None
+    n = len(vectors)
+    count = tracer.count()
+    return Measure(circuit, build, gate_bits(circuit), count['wire_changed'] / n,
+                   count['circuit_evaluated'] / n, elapsed / n * 1e6)
+
 class BaseCircuitTester(unittest.TestCase):
     """
     Base class for testing circuits. Adds dry and helpful assert method
     """
-    def _tester(self, circuit, truth_table):
-        gen = SignalGen.sweep_circuit(circuit)
-        states = [circuit.state_int for _ in gen.iterate()]
-        generated_table = TruthTable(states)
+    def _tester(self, circuit, truth_table, parallel=False):
+        """Sweep circuit and compare its truth table with truth_table.
+        If parallel is True the circuit is compiled and swept bit-parallel,
+        which requires a combinational circuit"""
+        if parallel:
+            generated_table = circuit.compile().sweep()
+        else:
+            gen = SignalGen.sweep_circuit(circuit)
+            states = [circuit.state_int for _ in gen.iterate()]
+            generated_table = TruthTable(states)
         self.assertEqual(truth_table, generated_table)
 
     def assertSigEq(self, bus, n):
@@ -175,3 +261,51 @@ class Inspector:
         """Calls states in all circuits and appends the result to the list of states"""
         state = {name : circuit.state_internal for name, circuit in self.circuits.items()}
         self.states.append(state)
+
+
+class LoggingTracer(Tracer):
+    """Tracer which logs every callback at level, in debug by default"""
+    def __init__(self, level=logging.DEBUG, logger=logger):
+        self.level = level
+        self.logger = logger
+
+    def wire_changed(self, index, bit):
+        self.logger.log(self.level, 'Wire %s changed to %s', index, bit)
+
+    def event_queued(self, index):
+        self.logger.log(self.level, 'New Updater event: %s', index)
+
+    def circuit_evaluated(self, circuit):
+        self.logger.log(self.level, 'Updated circuit %s', circuit)
+
+
+class RecordingTracer(Tracer):
+    """
+    Tracer which keeps a Record for every callback in records.
+    Records have the kind of callback (ie. its name), its target, a wire index
+    or a circuit, and a value, the new bit of changed wires.
+    """
+    Record = namedtuple('Record', 'kind target value')
+    def __init__(self):
+        self.records = []
+
+    def wire_changed(self, index, bit):
+        self.records.append(self.Record('wire_changed', index, bit))
+
+    def event_queued(self, index):
+        self.records.append(self.Record('event_queued', index, None))
+
+    def circuit_evaluated(self, circuit):
+        self.records.append(self.Record('circuit_evaluated', circuit, None))
+
+    def count(self):
+        """Return a Counter of records by kind"""
+        return Counter(record.kind for record in self.records)
+
+    def evaluations(self):
+        """Return a Counter of circuit evaluations by class name"""
+        return Counter(type(record.target).__name__ for record in self.records
+                       if record.kind == 'circuit_evaluated')
+
+    def clear(self):
+        self.records.clear()
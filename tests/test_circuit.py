@@ -81,6 +81,19 @@ class TestBaseCircuit(unittest.TestCase):
         inputs = [b for b in obj.get_inputs()]
         self.assertEqual(l, inputs)
 
+    def test_get_input_cached(self):
+        """get_inputs reuses the namedtuple class for the same labels"""
+        obj = self.obj_bus()
+        self.assertIs(type(obj.get_inputs()), type(obj.get_inputs()))
+
+    def test_apply(self):
+        obj = self.obj_bus()
+        obj.apply(a=3, b=12)
+        self.assertEqual(int(self.a.signal), 3)
+        self.assertEqual(int(self.b.signal), 12)
+        with self.assertRaises(ValueError):
+            obj.apply(y=1)
+
     def test_set_outputs(self):
         obj = self.obj_bus()
         obj.set_outputs(y=self.y)
@@ -92,6 +105,24 @@ class TestBaseCircuit(unittest.TestCase):
         self.assertEqual(obj.a, self.a)
         self.assertEqual(obj.b, self.b)
 
+    def test_accessors(self):
+        """Circuits with labels of their own add accessors for them to their class"""
+        obj = self.obj_bus()
+        self.assertIs(type(obj), MockCircuit)
+        self.assertIn('a', MockCircuit.__dict__)
+        obj.a = 3
+        self.assertEqual(int(self.a.signal), 3)
+        self.assertIs(obj.y, obj.terminals['y'].y)
+        obj.y = 'attribute'
+        self.assertEqual(obj.y, 'attribute')
+        with self.assertRaises(AttributeError):
+            obj.c
+        swapped = MockCircuit(['y'], ['a'], size=4)
+        self.assertIs(swapped.a, swapped.terminals['a'].y)
+        self.assertIs(swapped.y, swapped.terminals['y'].a)
+        self.assertEqual(swapped._output_set, {'a'})
+        self.assertIs(self.obj_bus().a, self.a)
+
 if __name__ == '__main__':
     logging.basicConfig(filename='core.log', filemode='w', level=logging.DEBUG)
     unittest.main()
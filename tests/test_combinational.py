@@ -1,11 +1,11 @@
 #!/usr/bin/env python
 import base_tester
-import unittest, logging
+import unittest, logging, threading, gc
 from pdd.combinational_blocks import *
-from pdd.tools import TruthTable, SignalGen, BaseCircuitTester
+from pdd.tools import TruthTable, SignalGen, BaseCircuitTester, RecordingTracer, equivalent, gate_bits
 import truth_tables
-from pdd.core import Wire
-from pdd.dl import BaseCircuit
+from pdd.core import Wire, Simulation, Signal
+from pdd.dl import BaseCircuit, BehavioralCircuit, Bus
 
 
 
@@ -43,6 +43,19 @@ class TestGate(BaseCircuitTester):
         self._tester(circuit, truth_tables.AND_3in)
 
 
+    def test_ngate_tree(self):
+        """8 inputs are reduced in 3 levels, one gate each"""
+        for model in BaseCircuit.models:
+            gate = OR(inputs=8, size=2, model=model)
+            gate.apply(**{'a{}'.format(k) : 0 for k in range(8)})
+            self.assertSigEq(gate.y, 0)
+            gate.a5 = 2
+            self.assertSigEq(gate.y, 2)
+        self.assertEqual(len(OR(inputs=8, size=2).children), 3)
+        self.assertIsInstance(OR(inputs=8, size=2, model='behavioral'), PrimitiveGate)
+        self._tester(XOR(inputs=5, model='behavioral', size=1), XOR(inputs=5, size=1).compile().sweep())
+
+
 class TestCombinationalBlocks(BaseCircuitTester):
 
     def test_BaseMux(self):
@@ -53,6 +66,123 @@ class TestCombinationalBlocks(BaseCircuitTester):
         circuit = BaseDecoder()
         self._tester(circuit, truth_tables.BaseDecoder)
 
+    def test_Decoder_y(self):
+        decoder = Decoder(size=3)
+        self.assertIs(type(decoder), Decoder)
+        self.assertIs(decoder.y, decoder.y)
+        decoder.e = 1
+        for i in [1, 2, 3, 4, 5, 6, 7, 0]:
+            decoder.a = i
+            self.assertSigEq(decoder.y, 1 << i)
+
+    def test_PredecodedDecoder(self):
+        for size in range(1, 6):
+            with Simulation() as sim:
+                with sim.elaborate():
+                    decoder = PredecodedDecoder(a=Bus(size), e=Bus.vdd())
+            self.assertSigEq(decoder.y, 1)
+            for a in list(range(2 ** size)) + [0]:
+                decoder.a = a
+                self.assertSigEq(decoder.y, 1 << a)
+        decoder = PredecodedDecoder(size=3)
+        decoder.a = 5
+        self.assertSigEq(decoder.y, 0)
+        decoder.e = 1
+        self.assertSigEq(decoder.y, 1 << 5)
+        self.assertLess(gate_bits(PredecodedDecoder(size=8)), gate_bits(Decoder(size=8)) / 4)
+
+    def test_behavioral_decoder(self):
+        decoder = Decoder(size=3, model='behavioral')
+        self.assertIsInstance(decoder, BehavioralDecoder)
+        self.assertEqual(equivalent(Decoder, size=3), [])
+
+    def test_set_tristate(self):
+        """Circuits are updated as enables set after they are made change"""
+        en = Bus(1, 1)
+        gate = AND(a=Bus(1, 1), b=Bus(1, 1))
+        gate.set_tristate(y=en)
+        self.assertSigEq(gate.y, 1)
+        en.signal = 0
+        gate.a = 0
+        self.assertSigEq(gate.y, 1)
+        en.signal = 1
+        self.assertSigEq(gate.y, 0)
+
+    def test_tristate_reenable(self):
+        """An output enabled again after its enable was set on a made circuit
+        drives the value of the inputs changed while it was disabled"""
+        en = Bus(1, 1)
+        gate = OR(a=Bus(2, 0b01), b=Bus(2, 0b10))
+        gate.set_tristate(y=en)
+        self.assertSigEq(gate.y, 0b11)
+        en.signal = 0
+        gate.a = 0
+        gate.b = 0
+        self.assertSigEq(gate.y, 0b11)
+        en.signal = 1
+        self.assertSigEq(gate.y, 0)
+        en.signal = 0
+        gate.b = 0b10
+        en.signal = 1
+        self.assertSigEq(gate.y, 0b10)
+
+    def test_set_tristate_gates(self):
+        """Leaf circuits given their enables after they are made are gated"""
+        with Simulation() as sim:
+            en = Bus(1, 1)
+            gate = AND(a=Bus(1, 1), b=Bus(1, 1))
+            self.assertFalse(gate.gated)
+            gate.set_tristate(y=en)
+            self.assertTrue(gate.gated)
+            en.signal = 0
+            self.assertTrue(gate.disabled)
+            sim.updater.tracer = tracer = RecordingTracer()
+            gate.a = 0
+            self.assertEqual(tracer.count()['circuit_evaluated'], 0)
+            en.signal = 1
+            self.assertFalse(gate.disabled)
+            self.assertSigEq(gate.y, 0)
+
+    def test_rom(self):
+        """Only the addressed cell drives the output of a ROM, disabled cells aren't evaluated"""
+        words = [3, 5, 7, 9]
+        with Simulation() as sim:
+            with sim.elaborate():
+                rom = ROM(4, addr=Bus(2), ce=Bus.vdd())
+            rom.burn(words)
+            sim.updater.tracer = tracer = RecordingTracer()
+            for i in [1, 2, 3, 0]:
+                rom.addr = i
+                self.assertSigEq(rom.q, words[i])
+                self.assertFalse(rom.terminals['q'].a.contention)
+                cells = {id(record.target) for record in tracer.records
+                         if record.kind == 'circuit_evaluated' and record.target in rom.cells}
+                self.assertEqual(len(cells), 2)
+                tracer.clear()
+            disabled = [cell for cell in rom.cells if cell.disabled]
+            self.assertEqual(disabled, rom.cells[1:])
+            disabled[0].a = 15
+            self.assertEqual(tracer.count()['circuit_evaluated'], 0)
+            rom.addr = 1
+            self.assertSigEq(rom.q, 15)
+
+    def test_four_state_inv(self):
+        """INV and ROM cells tie their spare input to GND, which would be X otherwise"""
+        with Simulation(four_state=True):
+            inv = INV(a=Bus(2, 0b01))
+            self.assertEqual(inv.y.signal, Signal(0b10, 2))
+            y = Bus(3)
+            inv = INV(y=y)
+            inv.a = 0b101
+            self.assertEqual(y.signal, Signal(0b010, 3))
+            self.assertEqual(str(OR(a=Bus(2, 0b01), bubbles=['y']).y.signal), '0bx0')
+            with Simulation.current().elaborate():
+                rom = ROM(4, addr=Bus(2), ce=Bus.vdd())
+            rom.burn([3, 5, 7, 9])
+            for i in [1, 2, 3, 0]:
+                rom.addr = i
+                self.assertEqual(rom.q.signal, Signal([3, 5, 7, 9][i], 4))
+
     def test_Mux_base_case(self):
         circuit = Mux(1, size=1)
         self._tester(circuit, truth_tables.BaseMux)
@@ -90,6 +220,18 @@ class ArithmeticCircuit(BaseCircuitTester):
         self.assertEqual(int(adder.s.signal), 0)
         self.assertEqual(int(adder.cout.signal), 1)
 
+    def test_prefix_adders(self):
+        """Prefix adders add as CPA, every input of 3 bits and sampled inputs of 32 bits"""
+        table = CPA(size=3).compile().sweep()
+        for cls in (KoggeStone, BrentKung, CarryLookahead):
+            self._tester(cls(size=3), table, parallel=True)
+            adder = cls(size=32)
+            for k in range(50):
+                a, b, cin = k * 0x9e3779b1 % 2**32, k * 0x85ebca6b % 2**32, k % 2
+                adder.apply(a=a, b=b, cin=cin)
+                self.assertSigEq(adder.s, (a + b + cin) % 2**32)
+                self.assertSigEq(adder.cout, (a + b + cin) >> 32)
+
     def test_subtractor(self):
         circuit = Subtractor(size=4)
         circuit.a = 4
@@ -108,6 +250,13 @@ class ArithmeticCircuit(BaseCircuitTester):
         circ.b = 3
         self.assertSigEq(circ.eq, 1)
 
+    def test_eq_comp_single_bit(self):
+        circ = EqualityComparator(size=1)
+        circ.a = 1
+        self.assertSigEq(circ.eq, 0)
+        circ.b = 1
+        self.assertSigEq(circ.eq, 1)
+
     def test_comp(self):
         circ = Comparator(size=4)
         #case a < b
@@ -137,7 +286,233 @@ class ArithmeticCircuit(BaseCircuitTester):
         self.assertSigEq(circ.lt, 0)
         self.assertSigEq(circ.gt, 0)
         self.assertSigEq(circ.gte, 1)
-        
+
+
+    def test_shared_comp(self):
+        """Unsigned comparisons over every input of 3 bits, comparators built eagerly
+        or within elaborate are settled"""
+        for adder, deferred in [(CPA, False), (CPA, True), (KoggeStone, False)]:
+            with Simulation() as sim:
+                if deferred:
+                    with sim.elaborate():
+                        circ = SharedComparator(size=3, adder=adder)
+                else:
+                    circ = SharedComparator(size=3, adder=adder)
+                for label, value in dict(eq=1, neq=0, lt=0, lte=1, gt=0, gte=1).items():
+                    self.assertSigEq(circ.get_bus(label), value)
+                for a in range(8):
+                    for b in range(8):
+                        circ.apply(a=a, b=b)
+                        expected = dict(eq=a == b, neq=a != b, lt=a < b, lte=a <= b,
+                                        gt=a > b, gte=a >= b)
+                        for label, value in expected.items():
+                            self.assertSigEq(circ.get_bus(label), int(value))
+        self.assertLess(gate_bits(SharedComparator(size=8)), gate_bits(Comparator(size=8)) / 3)
+
+
+class TestLevelized(BaseCircuitTester):
+
+    def test_full_adder(self):
+        circuit = FullAdder()
+        circuit.levelize()
+        self._tester(circuit, truth_tables.FullAdder)
+
+    def test_cpa(self):
+        adder = CPA(size=4)
+        adder.levelize()
+        gates = [c for c in adder.walk() if isinstance(c, Gate)]
+        for gate in gates:
+            self.assertIsNotNone(adder.updater.get_rank(gate))
+        for a, b in [(3, 4), (0xf, 1), (7, 9)]:
+            adder.a = a
+            adder.b = b
+            self.assertSigEq(adder.s, (a + b) & 0xf)
+            self.assertSigEq(adder.cout, (a + b) >> 4)
+
+
+class TestFlatten(BaseCircuitTester):
+
+    def test_full_adder(self):
+        circuit = FullAdder()
+        self.assertGreater(circuit.flatten(), 0)
+        self._tester(circuit, truth_tables.FullAdder)
+
+    def test_cpa(self):
+        """Flattened adders produce fewer events"""
+        events = []
+        for flatten in (False, True):
+            with Simulation() as sim:
+                adder = CPA(size=4)
+            if flatten:
+                adder.flatten()
+                for terminal in adder.terminals.values():
+                    self.assertFalse(terminal.flattened)
+            sim.updater.tracer = tracer = RecordingTracer()
+            for a, b in [(3, 4), (0xf, 1), (7, 9)]:
+                adder.apply(a=a, b=b)
+                self.assertSigEq(adder.s, (a + b) & 0xf)
+                self.assertSigEq(adder.cout, (a + b) >> 4)
+            events.append(tracer.count()['event_queued'])
+        self.assertLess(events[1], events[0])
+
+
+class TestSimulation(BaseCircuitTester):
+
+    def test_isolated(self):
+        with Simulation() as sim:
+            adder = CPA(size=4)
+        self.assertIs(adder.updater, sim.updater)
+        self.assertEqual(sim.children, [adder])
+        self.assertIs(adder.a.store, sim.store)
+        adder.a = 3
+        adder.b = 4
+        self.assertSigEq(adder.s, 7)
+        self.assertNotIn(adder, Simulation.default.children)
+
+    def test_threads(self):
+        results = {}
+        def run(a, b):
+            with Simulation():
+                adder = CPA(size=8)
+                for _ in range(10):
+                    adder.a = a
+                    adder.b = b
+                    results[a, b] = int(adder.s.signal)
+        threads = [threading.Thread(target=run, args=(i, 2 * i)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {(i, 2 * i) : 3 * i for i in range(4)})
+
+    def test_prototype(self):
+        """Copies of a prototype get wires of their own in the current simulation"""
+        with Simulation() as sim:
+            prototype = CPA.prototype(size=4)
+            a = Bus(4, 3)
+            adders = prototype.instantiate(3, a=a, b=[Bus(4, i) for i in range(3)])
+            self.assertEqual([int(adder.s.signal) for adder in adders], [3, 4, 5])
+            self.assertEqual(sim.children, adders)
+            self.assertIs(adders[0].children[0].sim, sim)
+            a.signal = 8
+            self.assertEqual([int(adder.s.signal) for adder in adders], [8, 9, 10])
+            self.assertEqual(int(prototype.circuit.s.signal), 0)
+            with sim.elaborate():
+                adders = prototype.instantiate(2, a=a, b=[Bus(4, 1), Bus(4, 2)])
+                self.assertEqual(list(sim.deferred.values()), adders)
+            self.assertEqual([int(adder.s.signal) for adder in adders], [9, 10])
+        with self.assertRaises(ValueError):
+            CPA.prototype(a=Bus(4))
+
+    def test_discard(self):
+        """Discarded circuits give their wires back, except the ones still read"""
+        with Simulation() as sim:
+            a, b = Bus(4, 3), Bus(4, 4)
+            CPA(a=a, b=b).discard()
+            size = len(sim.store)
+            for _ in range(5):
+                with sim.elaborate():
+                    adder = CPA(a=a, b=b)
+                self.assertSigEq(adder.s, 7)
+                adder.discard()
+            self.assertEqual(len(sim.store), size)
+            self.assertEqual(sim.children, [])
+            self.assertEqual(sim.updater.relations.keys(), set())
+            with sim.elaborate():
+                adder = CPA(a=a, b=b)
+                inc = CPA(a=adder.s, b=Bus(4, 1))
+            adder.discard()
+            with sim.elaborate():
+                CPA(a=Bus(4, 1), b=Bus(4, 1))
+            self.assertSigEq(inc.s, 8)
+            w = Bus(1).resolve()
+            gate = OR(a=Bus(1, 1), b=Bus(1, 0), y=w)
+            self.assertEqual(list(sim.store.drivers[w.indexes[0]].values()), [1])
+            gate.discard()
+            self.assertEqual(sim.store.drivers[w.indexes[0]], {})
+            prototype = CPA.prototype(size=4)
+            prototype.instantiate(a=a, b=b)[0].discard()
+            size = len(sim.store)
+            for _ in range(5):
+                prototype.instantiate(a=a, b=b)[0].discard()
+            self.assertEqual(len(sim.store), size)
+
+    def test_elaborate(self):
+        """Deferred circuits subscribe and settle when the outermost block exits"""
+        with Simulation() as sim:
+            a = Bus(4, 3)
+            with sim.elaborate():
+                adder = CPA(a=a, b=Bus(4, 4))
+                with sim.elaborate():
+                    inc = CPA(a=adder.s, b=Bus(4, 1))
+                self.assertEqual(sim.updater.relations, {})
+                self.assertSigEq(adder.s, 0)
+            self.assertSigEq(adder.s, 7)
+            self.assertSigEq(inc.s, 8)
+            a.signal = 5
+            self.assertSigEq(inc.s, 10)
+            self.assertEqual(sim.deferred, {})
+
+    def test_elaborate_eager(self):
+        """Circuits built within elaborate settle as circuits built eagerly do:
+        bubbled outputs and buses preset on outputs are driven"""
+        def build(deferred, bubbles=(), s=None):
+            with Simulation() as sim:
+                kwargs = dict(a=Bus(4, 0), b=Bus(4, 0), bubbles=list(bubbles))
+                if s is not None:
+                    kwargs['s'] = Bus(4, s)
+                if deferred:
+                    with sim.elaborate():
+                        adder = CPA(**kwargs)
+                else:
+                    adder = CPA(**kwargs)
+                return int(adder.s.signal), int(adder.cout.signal)
+        for options in [dict(bubbles=['s', 'cout']), dict(s=0xf), dict(bubbles=['s'], s=3)]:
+            self.assertEqual(build(True, **options), build(False, **options))
+        self.assertEqual(build(True, bubbles=['s', 'cout']), (0xf, 1))
+        self.assertEqual(build(True, s=0xf), (0, 0))
+
+    def test_elaborate_error(self):
+        """Circuits deferred by a failed elaborate block aren't set up by the next one"""
+        with Simulation() as sim:
+            with self.assertRaises(ValueError):
+                with sim.elaborate():
+                    adder = CPA(a=Bus(4, 3), b=Bus(4, 4))
+                    CPA(a=Bus(4), b=Bus(3))
+            self.assertEqual(sim.deferred, {})
+            self.assertEqual(sim.deferring, 0)
+            self.assertTrue(gc.isenabled())
+            with sim.elaborate():
+                inc = CPA(a=Bus(4, 1), b=Bus(4, 1))
+            self.assertSigEq(inc.s, 2)
+            self.assertSigEq(adder.s, 0)
+            self.assertEqual(sim.updater.subscribers(adder.a.indexes[0]), [])
+
+
+class TestBehavioral(BaseCircuitTester):
+
+    def test_model(self):
+        self.assertIs(type(CPA(size=4)), CPA)
+        adder = CPA(size=4, model='behavioral')
+        self.assertIsInstance(adder, BehavioralCPA)
+        self.assertEqual(adder.children, [])
+        adder.apply(a=0xf, b=2, cin=1)
+        self.assertSigEq(adder.s, 2)
+        self.assertSigEq(adder.cout, 1)
+        with self.assertRaises(ValueError):
+            CPA(size=4, model='rtl')
+
+    def test_equivalent(self):
+        self.assertEqual(equivalent(CPA, size=3), [])
+        self.assertEqual(equivalent(CPA, size=16, samples=100, seed=0), [])
+        with self.assertRaises(ValueError):
+            equivalent(FullAdder)
+
+    def test_function(self):
+        inc = BehavioralCircuit(function=lambda a: dict(y=a.value + 1),
+                                input_labels=['a'], output_labels=['y'], size=4)
+        inc.a = 0xf
+        self.assertSigEq(inc.y, 0)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,93 @@
+import base_tester
+import unittest
+import truth_tables
+from pdd.combinational_blocks import CPA, Mux, AND, XOR, FullAdder, BaseMux
+from pdd.sequential_blocks import Counter, FlipFlop, SRLatch
+from pdd.tools import BaseCircuitTester, SignalGen, TruthTable
+
+
+class TestCompiler(BaseCircuitTester):
+
+    def test_gate(self):
+        circuit = AND(size=2, bubbles=['b'])
+        compiled = circuit.compile()
+        self.assertEqual(len(compiled), 2)
+        compiled.apply(a=3, b=1)
+        self.assertEqual(int(compiled.read(circuit.y)), 2)
+
+    def test_primitive_gate(self):
+        circuit = AND(inputs=5, size=2, bubbles=['a1', 'y'], model='behavioral')
+        compiled = circuit.compile()
+        compiled.apply(a0=3, a1=0, a2=3, a3=1, a4=3)
+        self.assertEqual(int(compiled.read(circuit.y)), 2)
+        compiled.sync()
+        self.assertSigEq(circuit.y, 2)
+        self._tester(AND(inputs=3, size=1, model='behavioral'), truth_tables.AND_3in, parallel=True)
+
+    def test_cpa(self):
+        adder = CPA(size=4)
+        compiled = adder.compile()
+        for a, b in [(3, 4), (0xf, 1), (7, 9)]:
+            compiled.apply(a=a, b=b)
+            self.assertEqual(int(compiled.read(adder.s)), (a + b) & 0xf)
+            self.assertEqual(int(compiled.read(adder.cout)), (a + b) >> 4)
+
+    def test_sync(self):
+        mux = Mux(2, size=2)
+        compiled = mux.compile()
+        compiled.apply(d0=0, d1=1, d2=2, d3=3, s=2)
+        self.assertSigEq(mux.y, 0)
+        compiled.sync()
+        self.assertSigEq(mux.y, 2)
+
+    def test_counter(self):
+        circ = Counter(size=3)
+        compiled = circ.compile()
+        compiled.apply(r=1)
+        compiled.apply(clk=1)
+        compiled.apply(clk=0, r=0, c=1)
+        for i in range(2**3):
+            self.assertEqual(int(compiled.read(circ.q)), i)
+            compiled.apply(clk=1)
+            compiled.apply(clk=0)
+        self.assertEqual(int(compiled.read(circ.q)), 0)
+
+    def test_tristate(self):
+        circ = FlipFlop(size=2)
+        compiled = circ.compile()
+        compiled.apply(r=1)
+        compiled.apply(clk=1)
+        compiled.apply(clk=0, r=0)
+        self.assertEqual(int(compiled.read(circ.q)), 0)
+        compiled.apply(d=3)
+        compiled.apply(clk=1)
+        compiled.apply(clk=0)
+        self.assertEqual(int(compiled.read(circ.q)), 3)
+        compiled.apply(e=1, d=1)
+        compiled.apply(clk=1)
+        self.assertEqual(int(compiled.read(circ.q)), 3)
+
+
+class TestParallelSweep(BaseCircuitTester):
+
+    def test_gates(self):
+        self._tester(XOR(size=1, bubbles=['y']), truth_tables.XNOR, parallel=True)
+        self._tester(BaseMux(size=1), truth_tables.BaseMux, parallel=True)
+        self._tester(FullAdder(size=1), truth_tables.FullAdder, parallel=True)
+
+    def test_cpa(self):
+        adder = CPA(size=3)
+        gen = SignalGen.sweep_circuit(adder)
+        table = TruthTable([adder.state_int for _ in gen.iterate()])
+        self._tester(adder, table, parallel=True)
+        flat = CPA(size=3)
+        flat.flatten()
+        self._tester(flat, table, parallel=True)
+
+    def test_cyclic(self):
+        with self.assertRaises(ValueError):
+            SRLatch(size=1).compile().sweep()
+
+
+if __name__ == '__main__':
+    unittest.main()
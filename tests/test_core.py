@@ -1,30 +1,69 @@
 #! /usr/bin/env python
 import base_tester
-import unittest, logging
+import unittest, logging, gc, copy
 from collections import namedtuple
-from pdd.core import Signal, Updater, Wire, StaticWire
+from pdd.core import Signal, Updater, Wire, StaticWire, WireStore, Simulation
 
 class mockUpdater:
     events = []
+    tracer = None
+    updating = False
+    auto_update = False
     def notify(self, event):
         self.events.append(event)
 
 class TestWire(unittest.TestCase):
 
     def setUp(self):
-        Wire.updater = mockUpdater()
+        self.store = WireStore(mockUpdater())
     
     def test_wire(self):
-        w = Wire()
+        w = Wire(store=self.store)
         self.assertEqual(w.bit, 0)
-        w = Wire(1)
+        w = Wire(1, store=self.store)
         self.assertEqual(w.bit, 1)
 
     def test_event(self):
-        w = Wire()
+        w = Wire(store=self.store)
         w.bit = 1
         self.assertTrue(w.updater.events != [])
         
+class TestWireStore(unittest.TestCase):
+
+    def test_alloc(self):
+        store = WireStore()
+        self.assertEqual(len(store), 2)
+        indexes = store.alloc(4, 1)
+        self.assertEqual(indexes, range(2, 6))
+        self.assertEqual(store.bits[2:6], bytearray([1]*4))
+
+    def test_release(self):
+        store = WireStore()
+        indexes = store.alloc(4, 1)
+        store.alloc(2)
+        store.release([indexes[1], indexes[2], indexes[0]])
+        self.assertEqual(store.free, [range(2, 5)])
+        self.assertEqual(store.alloc(2), range(2, 4))
+        self.assertEqual(store.bits[2:4], bytearray([0, 0]))
+        self.assertEqual(store.alloc(2), range(8, 10))
+        self.assertEqual(store.free, [range(4, 5)])
+        self.assertEqual(store.allocated, 10)
+
+    def test_pack(self):
+        store = WireStore()
+        indexes = store.alloc(4)
+        store.bits[indexes[0]] = 1
+        store.bits[indexes[2]] = 1
+        self.assertEqual(store.pack(indexes), 0b0101)
+        self.assertEqual(store.pack([indexes[2], WireStore.VDD, indexes[1]]), 0b011)
+        self.assertEqual(store.pack([]), 0)
+
+    def test_handles(self):
+        store = Simulation.current().store
+        w = Wire.handle(WireStore.VDD, store)
+        self.assertEqual(w, StaticWire(1))
+        self.assertEqual(w.bit, 1)
+
 class TestStaticWire(unittest.TestCase):
 
     def test_wire(self):
@@ -64,40 +103,90 @@ class TestSignal(unittest.TestCase):
         self.assertEqual(Signal.OR(a, b), Signal(0b1111, 4))
         self.assertEqual(Signal.AND(a, b), Signal(0b0000, 4))
         self.assertEqual(Signal.XOR(a, b), Signal(0b1111, 4))
+
+    def test_immutable(self):
+        a = Signal(0b0101, 4)
+        self.assertIs(a, Signal(0b0101, 4))
+        self.assertIsNot(Signal(2**40, 64), Signal(2**40, 64))
+        self.assertEqual(hash(Signal(2**40, 64)), hash(Signal(2**40, 64)))
+        self.assertIs(copy.deepcopy(a), a)
+        with self.assertRaises(AttributeError):
+            a.value = 3
+        self.assertEqual(Signal(-1, 4).bits, (1, 1, 1, 1))
+        self.assertEqual(Signal(0, 70).complement().bits, (1,) * 70)
+
+    def test_four_state(self):
+        x = Signal(0b11, 2, 0b11)
+        z = Signal(0b00, 2, 0b11)
+        self.assertEqual(x.bits, (WireStore.X, WireStore.X))
+        self.assertEqual(str(Signal(0b0110, 4, 0b0011)), '0b01xz')
+        self.assertNotEqual(x, Signal(0b11, 2))
+        self.assertEqual(Signal.AND(x, Signal(0b01, 2)), Signal(0b01, 2, 0b01))
+        self.assertEqual(Signal.OR(z, Signal(0b01, 2)), Signal(0b11, 2, 0b10))
+        self.assertEqual(Signal.XOR(x, Signal(0b01, 2)), x)
+        self.assertEqual(Signal.NOT(z), x)
         
 class mockCircuit:
     updated = False
+    updates = 0
     def update(self):
         self.updated = True
+        self.updates += 1
 
 class testUpdate(unittest.TestCase):
     def setUp(self):
-        self.updater = Updater()
-        Wire.updater = self.updater
-        self.w1 = Wire()
-        self.w2 = Wire()
+        self.sim = Simulation()
+        self.updater = self.sim.updater
+        self.w1 = Wire(store=self.sim.store)
+        self.w2 = Wire(store=self.sim.store)
         self.circ_a = mockCircuit()
         self.updater.events = [] #erases useless updates from init
-        self.updater.subscribe(self.circ_a, (self.w1, self.w2))
+        self.updater.subscribe(self.circ_a, (self.w1.index, self.w2.index))
 
     def test_subscribe(self):
         """Test Updater.subscribe method"""
-        self.assertTrue(id(self.w1) in self.updater.relations)
-        self.assertTrue(id(self.w2) in self.updater.relations)
+        self.assertTrue(self.w1.index in self.updater.relations)
+        self.assertTrue(self.w2.index in self.updater.relations)
 
     def test_unsubsribe(self):
         """Test Updater.unsubscribe method"""
-        self.updater.unsubscribe(self.circ_a, (self.w1, self.w2))
+        self.updater.unsubscribe(self.circ_a, (self.w1.index, self.w2.index))
         self.assertTrue(self.circ_a not in self.updater.relations.values())
 
+    def test_collected(self):
+        """Subscriptions of collected circuits are dropped"""
+        circ_b = mockCircuit()
+        self.updater.subscribe(circ_b, (self.w1.index,))
+        self.assertEqual(self.updater.subscribers(self.w1.index), [self.circ_a, circ_b])
+        del circ_b
+        gc.collect()
+        self.updater.purge()
+        self.assertEqual(self.updater.subscribers(self.w1.index), [self.circ_a])
+        self.assertEqual(len(self.updater.relations[self.w1.index]), 1)
+
     def test_update(self):
         self.assertFalse(self.updater.events)
         self.assertFalse(self.circ_a.updated)
 
+        self.updater.auto_update = False
         self.w1.bit = 1
-        self.assertTrue(len(self.updater.events), 1)
+        self.assertEqual(len(self.updater.events), 1)
+        self.assertFalse(self.circ_a.updated)
         self.updater.update()
         self.assertTrue(self.circ_a.updated)
+        self.assertFalse(self.updater.events)
+
+    def test_update_once_per_delta(self):
+        """Circuit is updated once per delta regardless of how many triggers changed"""
+        self.updater.auto_update = False
+        try:
+            self.w1.bit = 1
+            self.w2.bit = 1
+            self.updater.update()
+        finally:
+            self.updater.auto_update = True
+        self.assertEqual(self.circ_a.updates, 1)
+        self.assertFalse(self.updater.events)
 
 
 if __name__ == '__main__':
@@ -1,7 +1,7 @@
 import base_tester
 import unittest, logging, pdb
 from pdd.dl import Bus, Terminal
-from pdd.core import Signal
+from pdd.core import Signal, Simulation
 
 class TestBus(unittest.TestCase):
 
@@ -26,6 +26,41 @@ class TestBus(unittest.TestCase):
         b_slice.signal = 0b11
         self.assertEqual(b.signal, Signal(14, 4))
 
+    def test_shared_wires(self):
+        """Buses made from other buses share their wires"""
+        b = Bus(4)
+        c = b[1:3] + b[0]
+        self.assertEqual(list(c.indexes), [b.indexes[0], b.indexes[1], b.indexes[2]])
+        c.signal = 0b110
+        self.assertEqual(int(b.signal), 0b0110)
+        self.assertEqual([w.bit for w in b.wires], [0, 1, 1, 0])
+
+    def test_views(self):
+        """Bus operations don't allocate wires"""
+        b = Bus(8)
+        store = b.store
+        wires = len(store)
+        self.assertEqual(b[2:6].indexes, range(b.indexes[2], b.indexes[6]))
+        self.assertEqual((b[4:] + b[:4]).indexes, b.indexes)
+        self.assertEqual([bus.indexes for bus in b.split()], [b.indexes[i:i+1] for i in range(8)])
+        b.branch(4), b.sign_extend(12), b.zero_extend(12), Bus.vdd(4), b[3]
+        self.assertEqual(len(store), wires)
+        with self.assertRaises(ValueError):
+            b[4:2]
+
+    def test_transaction(self):
+        """A bus write is handled in a single cycle"""
+        class Counter:
+            updates = 0
+            def update(self):
+                self.updates += 1
+        b = Bus(8, 0x0f)
+        counter = Counter()
+        b.store.updater.subscribe(counter, list(b.indexes))
+        b.signal = 0xf0
+        self.assertEqual(counter.updates, 1)
+        self.assertEqual(int(b.signal), 0xf0)
+
     def test_add_single_bit(self):
         """Add two buses of len 1"""
         a = Bus(1, 1)
@@ -136,6 +171,54 @@ class TestTerminal(unittest.TestCase):
             self.t.en = a
         with self.assertRaises(TypeError):
             self.t.a = 5
+
+    def test_resolved(self):
+        """Terminals driving a resolved bus contribute while enabled"""
+        w = Bus(2).resolve()
+        en1, en2 = Bus(1, 1), Bus(1, 0)
+        t1 = Terminal(2, 't1', a=Bus(2, 1), y=w, en=en1)
+        t2 = Terminal(2, 't2', a=Bus(2, 2), y=w, en=en2)
+        t1.propagate()
+        t2.propagate()
+        self.assertEqual(int(w.signal), 1)
+        self.assertFalse(w.contention)
+        en2.set()
+        t2.propagate()
+        self.assertEqual(int(w.signal), 3)
+        self.assertTrue(w.contention)
+        en1.reset()
+        t1.propagate()
+        self.assertEqual(int(w.signal), 2)
+        self.assertFalse(w.contention)
+        en2.reset()
+        t2.propagate()
+        self.assertEqual(int(w.signal), 2)
+        self.assertEqual(w.store.drivers[w.indexes[0]], {})
+        en1.set()
+        t1.propagate()
+        self.assertEqual(w.store.drivers[w.indexes[0]], {id(t1) : 1})
+        t1.withdraw()
+        self.assertEqual(w.store.drivers[w.indexes[0]], {})
+
+    def test_four_state(self):
+        """Resolved buses float to Z, drivers which disagree give X"""
+        with Simulation(four_state=True):
+            w = Bus(2).resolve()
+            self.assertEqual(str(w.signal), '0bzz')
+            en1, en2 = Bus(1, 1), Bus(1, 0)
+            t1 = Terminal(2, 't1', a=Bus(2, 1), y=w, en=en1)
+            t2 = Terminal(2, 't2', a=Bus(2, 3), y=w, en=en2)
+            t1.propagate()
+            t2.propagate()
+            self.assertEqual(w.signal, Signal(1, 2))
+            en2.set()
+            t2.propagate()
+            self.assertEqual(str(w.signal), '0bx1')
+            en1.reset()
+            en2.reset()
+            t1.propagate()
+            t2.propagate()
+            self.assertEqual(str(w.signal), '0bzz')
         
 
     
@@ -5,8 +5,6 @@ import unittest, logging
 from pdd.core import Wire
 from pdd.tools import BaseCircuitTester
 
-Wire.auto_update = True
-
 
 class TestROM(BaseCircuitTester):
 
@@ -4,9 +4,7 @@ import unittest, logging
 from pdd.sequential_blocks import *
 from pdd.tools import TruthTable, SignalGen, BaseCircuitTester
 import truth_tables
-from pdd.core import Wire
-
-Wire.auto_update = True
+from pdd.core import Wire, Signal, Simulation
 
 class TestSequentialBase(BaseCircuitTester):
 
@@ -69,6 +67,59 @@ class TestSequentialBase(BaseCircuitTester):
         
 class TestSequentialBlocks(BaseCircuitTester):
 
+    def test_flattened_counter(self):
+        circ = Counter(size=3)
+        circ.flatten()
+        circ.r.set()
+        circ.clk.pulse()
+        circ.r.reset()
+        circ.c.set()
+        for i in range(2**3 + 1):
+            self.assertSigEq(circ.q, i % 2**3)
+            circ.clk.pulse()
+
+    def test_prefix_counter(self):
+        circ = Counter(size=4, adder=cb.KoggeStone)
+        self.assertTrue(any(isinstance(c, cb.KoggeStone) for c in circ.walk()))
+        circ.r.set()
+        circ.clk.pulse()
+        circ.r.reset()
+        circ.c.set()
+        for i in range(2**4 + 1):
+            self.assertSigEq(circ.q, i % 2**4)
+            circ.clk.pulse()
+
+    def test_levelized_counter(self):
+        """Latches fall back to the event engine in a levelized counter"""
+        with Simulation():
+            circ = Counter(size=3)
+            circ.levelize()
+            latches = [c for c in circ.walk() if isinstance(c, SRLatch)]
+            for gate in latches[0].children:
+                self.assertIsNone(circ.updater.get_rank(gate))
+            circ.r.set()
+            circ.clk.pulse()
+            circ.r.reset()
+            circ.c.set()
+            for i in range(2**3):
+                self.assertSigEq(circ.q, i)
+                circ.clk.pulse()
+            self.assertSigEq(circ.q, 0)
+
+    def test_four_state_counter(self):
+        """Counter state is X until reset"""
+        with Simulation(four_state=True):
+            circ = Counter(size=3, clk=Bus(1, 0), r=Bus(1, 0), c=Bus(1, 1))
+            self.assertEqual(str(circ.q.signal), '0bxxx')
+            circ.clk.pulse()
+            self.assertEqual(str(circ.q.signal), '0bxxx')
+            circ.r.set()
+            circ.clk.pulse()
+            circ.r.reset()
+            for i in range(2**3):
+                self.assertEqual(circ.q.signal, Signal(i, 3))
+                circ.clk.pulse()
+
     def test_counter(self):
         circ = Counter(size=4)
         clk = circ.clk
@@ -1,8 +1,11 @@
 import base_tester
 import unittest, logging
 import truth_tables
-from pdd.tools import TruthTable, IOHelper, SignalGen
+from pdd.tools import TruthTable, IOHelper, SignalGen, RecordingTracer
 from pdd.dl import Bus
+from pdd.core import Simulation
+from pdd.combinational_blocks import Gate, CPA
+from pdd.profiler import profile
 
 class TestTruthTable(unittest.TestCase):
 
@@ -61,6 +64,35 @@ class TestSignalGen(unittest.TestCase):
         
         
     
+class TestRecordingTracer(unittest.TestCase):
+
+    def test_records(self):
+        tracer = RecordingTracer()
+        with Simulation(tracer=tracer):
+            gate = Gate(Gate.AND, size=1)
+        tracer.clear()
+        gate.a = 1
+        gate.b = 1
+        kinds = tracer.count()
+        self.assertEqual(kinds['wire_changed'], kinds['event_queued'])
+        self.assertEqual(tracer.evaluations()['Gate'], kinds['circuit_evaluated'])
+        self.assertGreaterEqual(kinds['circuit_evaluated'], 2)
+        changed = [r for r in tracer.records if r.kind == 'wire_changed']
+        self.assertEqual(changed[0], RecordingTracer.Record('wire_changed', gate.a.indexes[0], 1))
+        self.assertEqual(changed[-1].target, gate.y.indexes[0])
+
+class TestProfiler(unittest.TestCase):
+
+    def test_report(self):
+        report = profile(CPA, size=4)
+        rows = report.rows
+        self.assertEqual(rows['CPA'].instances, 1)
+        self.assertEqual(rows['FullAdder'].instances, 4)
+        total = sum(row.wires for row in rows.values())
+        self.assertEqual(total, len(report.root.sim.store) - 2)
+        names = [name for name, _ in report.sorted('instances')]
+        self.assertEqual(names[0], 'Gate')
+
 if __name__ == '__main__':
     logging.basicConfig(filename='{}.log'.format(__file__), filemode='w', level=logging.DEBUG)
     unittest.main()